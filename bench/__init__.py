@@ -0,0 +1,8 @@
+"""Benchmarks do bot contra bancos sintéticos.
+
+    python -m bench --sizes 10000,100000 --modes journal,sqlite --out resultados.json
+    python -m bench --sizes 100000 --baseline resultados.json   # compara e falha se regredir
+
+Cada (tamanho, modo) roda num processo próprio (o main.py carrega o banco no import), dentro de
+um diretório temporário com o finance_v119.json gerado por bench.synth.
+"""
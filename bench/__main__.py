@@ -0,0 +1,65 @@
+"""python -m bench [--sizes 10000,100000] [--modes journal,json,sqlite] [--out arq.json] [--baseline arq.json]"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench import synth
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_case(src, mode, keep=False):
+    tmp = tempfile.mkdtemp(prefix=f"bench_{mode}_")
+    try:
+        shutil.copy(src, os.path.join(tmp, "finance_v119.json"))
+        env = dict(os.environ, DB_MODE=mode, ALLOWED_USERS="1", PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+        env.pop("GEMINI_API_KEY", None); env.pop("WEBHOOK_URL", None)
+        p = subprocess.run([sys.executable, "-m", "bench.run", "out.json"], cwd=tmp, env=env, capture_output=True, text=True)
+        if p.returncode: raise RuntimeError(f"bench.run falhou ({mode}):\n{p.stderr[-3000:]}")
+        with open(os.path.join(tmp, "out.json")) as f: return json.load(f)
+    finally:
+        if keep: print(f"   mantido em {tmp}")
+        else: shutil.rmtree(tmp, ignore_errors=True)
+
+def compare(report, baseline, threshold):
+    """Operações cujo median_ms piorou mais que `threshold` (e mais de 1ms) em relação ao baseline."""
+    old = {(r["size"], r["mode"]): r["results"] for r in baseline["runs"]}; worse = []
+    for r in report["runs"]:
+        for op, cur in r["results"].items():
+            prev = old.get((r["size"], r["mode"]), {}).get(op)
+            if prev and cur["median_ms"] > prev["median_ms"] * (1 + threshold) and cur["median_ms"] - prev["median_ms"] > 1:
+                worse.append((r["size"], r["mode"], op, prev["median_ms"], cur["median_ms"]))
+    return worse
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmarks do bot com bancos sintéticos")
+    ap.add_argument("--sizes", default="10000,100000"); ap.add_argument("--modes", default="journal")
+    ap.add_argument("--clients", type=int); ap.add_argument("--years", type=float, default=3); ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", default="bench_results.json"); ap.add_argument("--baseline"); ap.add_argument("--threshold", type=float, default=0.25)
+    ap.add_argument("--keep", action="store_true", help="não apaga os diretórios temporários")
+    a = ap.parse_args()
+    report = {"meta": {"python": platform.python_version(), "platform": platform.platform(), "seed": a.seed, "when": time.strftime("%Y-%m-%dT%H:%M:%S")}, "runs": []}
+    gen_dir = tempfile.mkdtemp(prefix="bench_db_")
+    try:
+        for size in (int(s) for s in a.sizes.split(",")):
+            src = os.path.join(gen_dir, f"db_{size}.json"); t0 = time.perf_counter()
+            synth.write(synth.generate(size, a.clients, years=a.years, seed=a.seed), src)
+            print(f"📦 {size} transações geradas em {time.perf_counter() - t0:.1f}s ({os.path.getsize(src) / 1e6:.1f} MB)")
+            for mode in a.modes.split(","):
+                r = run_case(src, mode, a.keep); report["runs"].append({"size": size, "mode": mode, **r})
+                for op, v in r["results"].items(): print(f"   {mode:8} {op:32} {v['median_ms']:10.2f} ms  (n={v['runs']})")
+    finally: shutil.rmtree(gen_dir, ignore_errors=True)
+    with open(a.out, "w") as f: json.dump(report, f, indent=1)
+    print(f"💾 {a.out}")
+    if a.baseline:
+        with open(a.baseline) as f: worse = compare(report, json.load(f), a.threshold)
+        for size, mode, op, old, new in worse: print(f"🔴 {size}/{mode} {op}: {old:.2f} -> {new:.2f} ms")
+        if worse: sys.exit(1)
+        print("🟢 Sem regressões")
+
+if __name__ == "__main__": main()
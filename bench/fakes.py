@@ -0,0 +1,73 @@
+"""Update/Context falsos: o bastante da API do python-telegram-bot para rodar os handlers sem rede."""
+import asyncio
+import collections
+import itertools
+import time
+from types import SimpleNamespace
+
+from telegram.error import RetryAfter
+
+_ids = itertools.count(1)
+
+class FakeBot:
+    """Com chat_rate/global_rate imita o flood control do Telegram: mais que isso em 1s (no chat / no total)
+    vira RetryAfter(retry_after). `latency` simula o tempo de ida e volta de cada chamada."""
+    def __init__(self, chat_rate=None, global_rate=None, retry_after=1, latency=0.0):
+        self.sent = []; self.chat_rate, self.global_rate, self.retry_after, self.latency = chat_rate, global_rate, retry_after, latency
+        self.windows = collections.defaultdict(collections.deque); self.flooded = 0
+
+    def _flood(self, chat_id):
+        now = time.monotonic()
+        for key, rate in ((chat_id, self.chat_rate), (None, self.global_rate)):
+            w = self.windows[key]
+            while w and now - w[0] >= 1: w.popleft()
+            if rate is not None and len(w) >= rate: self.flooded += 1; raise RetryAfter(self.retry_after)
+        self.windows[chat_id].append(now); self.windows[None].append(now)
+
+    def _log(self, kind, chat_id, payload):
+        self.sent.append((kind, chat_id)); return FakeMessage(self, chat_id, payload if isinstance(payload, str) else "")
+
+    async def send_message(self, chat_id, text, **kw):
+        if self.latency: await asyncio.sleep(self.latency)
+        if self.chat_rate or self.global_rate: self._flood(chat_id)
+        return self._log("message", chat_id, text)
+
+    async def send_document(self, chat_id, document, **kw):
+        if hasattr(document, "read"): document.read()  # o upload leria o arquivo inteiro
+        return self._log("document", chat_id, None)
+
+    async def send_photo(self, chat_id, photo, **kw): return self._log("photo", chat_id, None)
+
+class FakeMessage:
+    def __init__(self, bot, chat_id=1, text=""):
+        self.bot, self.chat_id, self.text, self.message_id = bot, chat_id, text, next(_ids)
+        self.photo = [SimpleNamespace(file_id=f"photo-{self.message_id}")]
+        self.chat = SimpleNamespace(id=chat_id)
+
+    async def reply_text(self, text, **kw): return await self.bot.send_message(self.chat_id, text)
+    async def reply_photo(self, photo, **kw): return await self.bot.send_photo(self.chat_id, photo)
+    async def reply_document(self, document, **kw): return await self.bot.send_document(self.chat_id, document)
+    async def edit_text(self, text, **kw): return self
+
+class FakeCallbackQuery:
+    def __init__(self, bot, data, user_id=1):
+        self.data, self.from_user = data, SimpleNamespace(id=user_id)
+        self.message = FakeMessage(bot, user_id)
+
+    async def answer(self, text=None, **kw): return True
+    async def edit_message_text(self, text, **kw): self.message.text = text; return self.message
+
+class FakeUpdate:
+    def __init__(self, bot, data=None, text=None, user_id=1):
+        self.update_id = next(_ids)
+        self.callback_query = FakeCallbackQuery(bot, data, user_id) if data is not None else None
+        self.message = FakeMessage(bot, user_id, text) if text is not None else None
+        self.effective_user = SimpleNamespace(id=user_id, first_name="Bench")
+        self.effective_chat = SimpleNamespace(id=user_id)
+        self.effective_message = self.message or (self.callback_query and self.callback_query.message)
+
+class FakeContext:
+    def __init__(self, bot, args=()):
+        self.bot, self.args, self.user_data, self.chat_data, self.bot_data, self.job = bot, list(args), {}, {}, {}, None
+
+def callback(bot, data, user_id=1): return FakeUpdate(bot, data=data, user_id=user_id), FakeContext(bot)
@@ -0,0 +1,117 @@
+"""Executa os benchmarks no diretório atual (que já tem o banco) e grava o resultado em JSON.
+
+Chamado por `python -m bench`; roda sozinho com `cd pasta_do_banco && python -m bench.run saida.json`.
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+os.environ.setdefault("ALLOWED_USERS", "1")  # ADMIN_ID = 1: alertas e restricted passam pelo FakeBot
+os.environ.pop("GEMINI_API_KEY", None)
+
+from bench.fakes import FakeBot, FakeContext, callback
+
+REPORTS = ["start", "menu_reports", "rep_list", "rep_rank", "rep_comp", "rep_forecast", "rep_nospend", "rep_insights", "menu_iptv", "iptv_list", "menu_goals"]
+PHRASES = ["Gastei 50 no mercado", "Recebi 1200 salário", "paguei 32,90 uber ontem", "ontem gastei 20 na padaria", "Me lembre de pagar a luz dia 20 às 14h", "comprei pizza 45"]
+DUE_REMINDERS = 200
+# Regressões do parser local: frase -> campos esperados (None = não confiável, vai para o Gemini).
+# "{ontem}" vira a data de ontem no formato do lançamento.
+PARSE_CASES = [
+    ("gastei 1.000.000 casa", {"type": "gasto", "val": 1000000.0}),
+    ("Recebi 2.500.000", {"type": "ganho", "val": 2500000.0}),
+    ("Gastei 1.500 no mercado", {"type": "gasto", "val": 1500.0, "cat": "Mercado"}),
+    ("paguei 32,90 uber", {"val": 32.9, "desc": "Uber"}),
+    ("Gastei 50 mercado ontem", {"val": 50.0, "desc": "Mercado", "date": "{ontem}"}),
+    ("ontem gastei 50 mercado", {"val": 50.0, "desc": "Mercado", "date": "{ontem}"}),
+    ("gastei 20 mercado amanhã", None),
+    ("Me lembre de pagar a luz dia 20 às 14h", {"type": "agenda", "text": "Pagar a luz"}),
+]
+
+def measure(fn, setup=None, min_runs=3, max_runs=50, budget=2.0):
+    """Roda `fn` ao menos min_runs vezes (uma só se a primeira já estourar o budget) e até gastar budget segundos."""
+    times = []; spent = 0.0
+    while len(times) < max_runs:
+        if setup: setup()
+        t0 = time.perf_counter(); fn(); dt = time.perf_counter() - t0
+        times.append(dt); spent += dt
+        if (len(times) >= min_runs or spent >= budget) and spent >= budget / 4: break
+    ms = [t * 1000 for t in times]
+    return {"runs": len(ms), "min_ms": round(min(ms), 3), "median_ms": round(statistics.median(ms), 3), "mean_ms": round(statistics.fmean(ms), 3), "max_ms": round(max(ms), 3)}
+
+def check_parser(main):
+    now = main.get_now(); ontem = (now - timedelta(days=1)).strftime("%d/%m/%Y %H:%M"); bad = []
+    for phrase, want in PARSE_CASES:
+        data, sure = main.parse_local(phrase, now); got = data if sure else None
+        if want is None: ok = got is None
+        else: ok = got is not None and all(got.get(k) == (v.format(ontem=ontem) if isinstance(v, str) else v) for k, v in want.items())
+        if not ok: bad.append(f"{phrase!r}: esperado {want}, veio {got}")
+    if bad: raise AssertionError("parser local:\n" + "\n".join(bad))
+
+def main_bench(out):
+    res = {}
+    t0 = time.perf_counter(); import main; res["import_main"] = {"runs": 1, "min_ms": round((time.perf_counter() - t0) * 1000, 3)}
+    res["import_main"].update(median_ms=res["import_main"]["min_ms"], mean_ms=res["import_main"]["min_ms"], max_ms=res["import_main"]["min_ms"])
+    loop = asyncio.new_event_loop(); asyncio.set_event_loop(loop); run = loop.run_until_complete
+    bot = FakeBot(); db = main.db; w = main.WRITER
+
+    def committed(fn):
+        def go():
+            c0 = w.commits; fn()
+            while w.commits <= c0: time.sleep(0.0002)
+        return go
+
+    res["load_db"] = measure(main.load_db)
+    keys = [k for k in db if k != "transactions"]
+    res["save_db_all"] = measure(committed(lambda: main.save_db(db, *keys)))
+    res["save_db_config"] = measure(committed(lambda: main.save_db(db, "config")))
+    now = main.get_now().strftime("%d/%m/%Y %H:%M")
+    res["add_transaction"] = measure(committed(lambda: (main.add_transaction({"id": os.urandom(4).hex(), "type": "gasto", "value": 10.0, "category": "Lazer", "description": "Bench", "date": now}), main.save_db(db))))
+    res["calc_stats"] = measure(main.calc_stats)
+    check_parser(main)
+    res["parse_local"] = measure(lambda: [main.parse_local(p, main.get_now()) for p in PHRASES])
+
+    for name in REPORTS:
+        fn = getattr(main, name)
+        res[f"handler:{name}"] = measure(lambda fn=fn, name=name: run(fn(*callback(bot, name))))
+    for name in ("rep_pie", "rep_evo"):
+        fn = getattr(main, name)
+        res[f"handler:{name}:cold"] = measure(lambda fn=fn, name=name: run(fn(*callback(bot, name))), setup=main.CHART_CACHE.clear)
+        res[f"handler:{name}:warm"] = measure(lambda fn=fn, name=name: run(fn(*callback(bot, name))))
+    for name in ("rep_csv", "rep_pdf"):
+        fn = getattr(main, name)
+        res[f"handler:{name}"] = measure(lambda fn=fn, name=name: run(fn(*callback(bot, name))), min_runs=1)
+
+    ctx = FakeContext(bot)
+    res["check_iptv_due"] = measure(lambda: run(main.check_iptv_due(ctx)))
+    base = list(db["reminders"]); past = (main.get_now() - timedelta(hours=1)).strftime("%Y-%m-%d %H:%M")
+    today = main.get_now().strftime("%Y-%m-%d")
+    def arm():
+        db["config"]["last_runs"] = {name: today for name, _, _ in main.DAILY_JOBS}
+        db["reminders"] = base + [{"text": f"Vencido {i}", "time": past, "chat_id": 1} for i in range(DUE_REMINDERS)]
+        main.sched_load()
+    res["sched_load"] = measure(arm)
+    async def fire():
+        await main.routine_checks(ctx); await asyncio.gather(*list(main.SCHED_TASKS))
+    res["routine_checks"] = measure(lambda: run(fire()), setup=arm)
+    db["reminders"] = base
+
+    trans = list(db["transactions"]); m = main.get_now().strftime("%m/%Y")
+    months = [(main.get_now() - main.relativedelta(months=i)).strftime("%m/%Y") for i in range(5, -1, -1)]
+    with tempfile.TemporaryDirectory() as tmp:
+        res["write_csv"] = measure(lambda: main.write_csv(main.iter_transactions(trans), os.path.join(tmp, "x.csv")), min_runs=1)
+        res["write_pdf"] = measure(lambda: main.write_pdf(main.iter_transactions(reversed(trans)), os.path.join(tmp, "x.pdf")), min_runs=1)
+    cats = main.month_group("gasto", m, "category") or {"Vazio": 1}
+    res["render_pie"] = measure(lambda: main.render_pie(cats))
+    res["render_evo"] = measure(lambda: main.render_evo([x[:2] for x in months], [main.month_total("gasto", x) for x in months]))
+
+    w.close(); loop.close()
+    meta = {"transactions": len(db["transactions"]), "iptv_clients": len(db["iptv_clients"]), "reminders": len(db["reminders"]), "db_mode": main.DB_MODE}
+    with open(out, "w") as f: json.dump({"meta": meta, "results": res}, f, indent=1)
+
+if __name__ == "__main__":
+    main_bench(sys.argv[1] if len(sys.argv) > 1 else "bench.json")
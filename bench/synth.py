@@ -0,0 +1,58 @@
+"""Gerador de bancos sintéticos no formato do finance_v119.json.
+
+    python -m bench.synth 100000 finance_v119.json [--clients 2000] [--years 3] [--seed 1]
+"""
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+
+GASTOS = {
+    "Alimentação": ["iFood", "Almoço", "Padaria", "Pizza", "Lanche", "Restaurante"],
+    "Transporte": ["Uber", "Gasolina", "Ônibus", "99", "Estacionamento"],
+    "Lazer": ["Cinema", "Bar", "Show", "Netflix", "Spotify"],
+    "Mercado": ["Mercado", "Feira", "Açougue", "Hortifruti"],
+    "Casa": ["Luz", "Água", "Internet", "Aluguel", "Gás"],
+}
+GANHOS = {"Salário": ["Salário"], "Extra": ["Freela", "Pix recebido", "Venda OLX"], "Vendas/IPTV": ["IPTV - {}"]}
+NOMES = ["Ana", "Bruno", "Carla", "Diego", "Elisa", "Fábio", "Gabi", "Hugo", "Iara", "João", "Karen", "Lucas", "Marta", "Nina", "Otávio", "Paula"]
+
+def generate(n_tx, clients=None, reminders=None, subs=None, years=3, seed=1, now=None):
+    """Banco com `n_tx` transações espalhadas nos últimos `years` anos (~85% gastos), em ordem de data."""
+    rng = random.Random(seed); now = now or datetime.utcnow() - timedelta(hours=3)
+    clients = n_tx // 50 if clients is None else clients
+    reminders = min(n_tx // 100, 5000) if reminders is None else reminders
+    subs = 30 if subs is None else subs
+    span = int(years * 365 * 1440); start = now - timedelta(minutes=span)
+    iptv = [{"id": f"{rng.getrandbits(32):08x}", "name": f"{rng.choice(NOMES)} {i}", "phone": f"219{rng.randrange(10**7, 10**8)}",
+             "day": rng.randint(1, 31), "value": float(rng.choice([25, 30, 35, 40, 50]))} for i in range(clients)]
+    mins = sorted(rng.randrange(span) for _ in range(n_tx)); trans = []
+    for m in mins:
+        if rng.random() < 0.85:
+            kind = "gasto"; cat = rng.choice(list(GASTOS)); desc = rng.choice(GASTOS[cat]); val = round(rng.lognormvariate(3.5, 0.9), 2)
+        else:
+            kind = "ganho"; cat = rng.choice(list(GANHOS)); desc = rng.choice(GANHOS[cat]); val = round(rng.uniform(30, 3000), 2)
+            if "{}" in desc: c = rng.choice(iptv) if iptv else {"name": "Cliente", "value": 30.0}; desc = desc.format(c["name"]); val = c["value"]
+        trans.append({"id": f"{rng.getrandbits(32):08x}", "type": kind, "value": val, "category": cat, "description": desc,
+                      "date": (start + timedelta(minutes=m)).strftime("%d/%m/%Y %H:%M")})
+    rems = [{"text": f"Pagar {rng.choice(GASTOS['Casa'])}", "time": (now + timedelta(minutes=rng.randrange(1, 90 * 1440))).strftime("%Y-%m-%d %H:%M"),
+             "chat_id": 1} for _ in range(reminders)]
+    return {
+        "transactions": trans, "shopping_list": ["Arroz", "Feijão", "Café"], "debts_v2": {n: round(rng.uniform(-500, 500), 2) for n in NOMES[:6]},
+        "categories": {"ganho": list(GANHOS), "gasto": list(GASTOS)},
+        "vip_users": {str(1000 + i): (now + timedelta(days=30)).strftime("%Y-%m-%d") for i in range(20)},
+        "config": {"panic_mode": False, "persona": "padrao"}, "reminders": rems,
+        "subscriptions": [{"name": f"Assinatura {i}", "val": float(rng.choice([9.9, 19.9, 39.9, 55.0])), "day": rng.randint(1, 28)} for i in range(subs)],
+        "iptv_clients": iptv, "goals": [{"name": "Viagem", "val": 5000.0}, {"name": "Reserva", "val": 20000.0}], "achievements": [],
+    }
+
+def write(data, path):
+    with open(path, "w", encoding="utf-8") as f: json.dump(data, f, ensure_ascii=False)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("transactions", type=int); ap.add_argument("out")
+    ap.add_argument("--clients", type=int); ap.add_argument("--reminders", type=int); ap.add_argument("--subs", type=int)
+    ap.add_argument("--years", type=float, default=3); ap.add_argument("--seed", type=int, default=1)
+    a = ap.parse_args()
+    write(generate(a.transactions, a.clients, a.reminders, a.subs, a.years, a.seed), a.out)
@@ -1,7 +1,8 @@
+import time
+_T0 = time.perf_counter()  # medição de partida (import e primeiro poll)
 import os
 import sys
 import subprocess
-import time
 import logging
 import threading
 import json
@@ -11,30 +12,50 @@ import random
 import calendar
 import asyncio
 import io
-from datetime import datetime, timedelta
+import csv
+import codecs
+import tempfile
+import gzip
+import hashlib
+import shutil
+import re
+import sqlite3
+import queue
+import heapq
+import itertools
+import collections
+import atexit
+import contextlib
+import contextvars
+import bisect
+import functools
+import hmac
+import secrets
+import signal
+import urllib.parse
+import urllib.request
+from collections import Counter, OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, date
 
 # ================= 1. AUTO-REPARO =================
 def install_and_restart():
-    required = ["flask", "apscheduler", "python-telegram-bot", "google-generativeai>=0.7.2", "matplotlib", "reportlab", "python-dateutil", "requests"]
+    required = ["flask", "python-telegram-bot", "google-generativeai>=0.7.2", "matplotlib", "numpy", "reportlab", "python-dateutil", "requests"]
     try:
         subprocess.check_call([sys.executable, "-m", "pip", "install", "--upgrade"] + required)
         time.sleep(2)
         os.execv(sys.executable, [sys.executable] + sys.argv)
     except: sys.exit(1)
 
+# Só o essencial para atender /start é importado aqui; matplotlib, reportlab e o SDK do Gemini
+# são carregados no primeiro uso (load_figure, write_pdf, init_ai).
 try:
-    from flask import Flask
-    import requests
-    from apscheduler.schedulers.background import BackgroundScheduler
-    import matplotlib
-    matplotlib.use('Agg')
-    import matplotlib.pyplot as plt
-    from reportlab.lib.pagesizes import letter
-    from reportlab.pdfgen import canvas
+    from flask import Flask, request, jsonify
     from dateutil.relativedelta import relativedelta
-    import google.generativeai as genai
     from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
-    from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, ConversationHandler, filters
+    from telegram.ext import ApplicationBuilder, BaseUpdateProcessor, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, ConversationHandler, filters
+    from telegram.error import BadRequest, NetworkError, RetryAfter
 except ImportError:
     install_and_restart()
 
@@ -54,60 +75,998 @@ DB_FILE = "finance_v119.json"
  IPTV_NAME, IPTV_PHONE, IPTV_DAY, IPTV_VAL, IPTV_EDIT_VAL, GOAL_NAME, GOAL_VAL, DEBT_INIT_VAL) = range(17)
 
 COLORS = ['#ff9999','#66b3ff','#99ff99','#ffcc99', '#c2c2f0','#ffb3e6']
-plt.style.use('dark_background')
 MY_PIX_KEY = "21998121271" # CHAVE PIX DAVID
 
+# --- MÉTRICAS (texto Prometheus em /metrics) ---
+# Histograma de latência por (tipo, operação): handler, queue, storage, ai, render, export, backup.
+# SLOW_MS > 0 loga toda operação acima do limite.
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SLOW_MS = float(os.getenv("SLOW_MS", "0"))
+METRICS = {}; METRIC_ERRORS = {}; METRIC_LOCK = threading.Lock()
+UPDATE_ENQ = {}  # update_id -> instante em que entrou na fila (webhook)
+
+def observe(kind, op, secs, error=False):
+    with METRIC_LOCK:
+        h = METRICS.get((kind, op))
+        if h is None: h = METRICS[(kind, op)] = [[0] * (len(METRIC_BUCKETS) + 1), 0.0]
+        h[0][bisect.bisect_left(METRIC_BUCKETS, secs)] += 1; h[1] += secs
+        if error: METRIC_ERRORS[(kind, op)] = METRIC_ERRORS.get((kind, op), 0) + 1
+    if SLOW_MS and secs * 1000 >= SLOW_MS: logger.warning(f"🐢 {kind}/{op}: {secs * 1000:.0f}ms")
+
+def timed(kind, op=None):
+    def deco(fn):
+        name = op or fn.__name__
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapped(*args, **kwargs):
+                t0 = time.perf_counter(); err = False
+                try: return await fn(*args, **kwargs)
+                except Exception: err = True; raise
+                finally: observe(kind, name, time.perf_counter() - t0, err)
+            return awrapped
+        @functools.wraps(fn)
+        def wrapped(*args, **kwargs):
+            t0 = time.perf_counter(); err = False
+            try: return fn(*args, **kwargs)
+            except Exception: err = True; raise
+            finally: observe(kind, name, time.perf_counter() - t0, err)
+        return wrapped
+    return deco
+
+def timed_handler(fn):
+    """Latência do handler + espera na fila (carimbo do webhook, ou idade da mensagem no polling)."""
+    inner = timed("handler")(fn)
+    @functools.wraps(fn)
+    async def wrapped(update, context, *args, **kwargs):
+        t0 = UPDATE_ENQ.pop(getattr(update, "update_id", None), None)
+        if t0: observe("queue", "update", time.perf_counter() - t0)
+        elif getattr(update, "message", None): observe("queue", "message_age", max(0.0, time.time() - update.message.date.timestamp()))
+        return await inner(update, context, *args, **kwargs)
+    return wrapped
+
+def wrap_handlers(app, deco, mark):
+    """Envolve o callback de todo handler registrado (inclusive dentro dos ConversationHandlers)."""
+    def walk(hs):
+        for h in hs:
+            if isinstance(h, ConversationHandler):
+                walk(h.entry_points); walk(h.fallbacks)
+                for st in h.states.values(): walk(st)
+            elif not getattr(h.callback, mark, False):
+                h.callback = deco(h.callback); setattr(h.callback, mark, True)
+    for group in app.handlers.values(): walk(group)
+
+def instrument_handlers(app): wrap_handlers(app, timed_handler, "_timed")
+
+def metric_lines(name, help_, kind_, samples):
+    yield f"# HELP {name} {help_}"; yield f"# TYPE {name} {kind_}"
+    for labels, v in samples:
+        lbl = ",".join(f'{k}="{x}"' for k, x in labels.items())
+        yield f"{name}{{{lbl}}} {v}" if lbl else f"{name} {v}"
+
 # ================= 3. IA SETUP =================
+# A descoberta do modelo (list_models = chamada de rede) roda numa thread disparada no post_init
+# ou no primeiro smart_entry, o que vier antes; a partida do bot não espera por ela.
+genai = None
 model_ai = None
-MODEL_STATUS = "IA OFF"
-if GEMINI_KEY:
-    genai.configure(api_key=GEMINI_KEY)
-    try:
-        all_models = list(genai.list_models())
-        valid_models = [m.name for m in all_models if 'generateContent' in m.supported_generation_methods]
-        if valid_models:
-            chosen = next((m for m in valid_models if 'flash' in m), next((m for m in valid_models if 'pro' in m), valid_models[0]))
-            model_ai = genai.GenerativeModel(chosen)
-            MODEL_STATUS = f"Conectado: {chosen}"
-            print(f"✅ {MODEL_STATUS}")
-        else: print("⚠️ Nenhum modelo disponível.")
-    except Exception as e:
-        print(f"❌ Erro IA: {e}"); 
-        try: model_ai = genai.GenerativeModel('gemini-pro')
-        except: pass
+MODEL_STATUS = "IA carregando..." if GEMINI_KEY else "IA OFF"
+AI_LOCK = threading.Lock(); AI_READY = False
+
+def init_ai():
+    global genai, model_ai, MODEL_STATUS, AI_READY
+    with AI_LOCK:
+        if AI_READY or not GEMINI_KEY: return model_ai
+        t0 = time.perf_counter()
+        try:
+            import google.generativeai as sdk
+            sdk.configure(api_key=GEMINI_KEY); genai = sdk
+        except ImportError: MODEL_STATUS = "IA OFF (SDK ausente)"; AI_READY = True; return None
+        try:
+            all_models = list(genai.list_models())
+            valid_models = [m.name for m in all_models if 'generateContent' in m.supported_generation_methods]
+            if valid_models:
+                chosen = next((m for m in valid_models if 'flash' in m), next((m for m in valid_models if 'pro' in m), valid_models[0]))
+                model_ai = genai.GenerativeModel(chosen)
+                MODEL_STATUS = f"Conectado: {chosen}"
+                print(f"✅ {MODEL_STATUS} ({time.perf_counter() - t0:.1f}s)")
+            else: print("⚠️ Nenhum modelo disponível."); MODEL_STATUS = "IA OFF"
+        except Exception as e:
+            print(f"❌ Erro IA: {e}"); MODEL_STATUS = "IA OFF"
+            try: model_ai = genai.GenerativeModel('gemini-pro'); MODEL_STATUS = "Conectado: gemini-pro"
+            except: pass
+        AI_READY = True
+        return model_ai
+
+async def get_model():
+    return model_ai if AI_READY else await asyncio.to_thread(init_ai)
+
+# Chamadas ao Gemini rodam em threads próprias (o SDK é bloqueante), limitadas por AI_SEM e com timeout.
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "4"))
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", "60"))
+AI_SEM = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+AI_POOL = ThreadPoolExecutor(max_workers=AI_MAX_CONCURRENCY, thread_name_prefix="ai")  # fora do executor padrão
+
+def ai_release(fut):
+    AI_SEM.release()  # a vaga só volta quando a thread termina, mesmo que o chamador já tenha desistido
+    if not fut.cancelled(): fut.exception()  # erro depois do timeout: ninguém mais espera por ele
+
+async def ai_call(fn, *args):
+    await AI_SEM.acquire()
+    try: fut = asyncio.get_running_loop().run_in_executor(AI_POOL, fn, *args)
+    except BaseException: AI_SEM.release(); raise
+    fut.add_done_callback(ai_release); t0 = time.perf_counter(); err = False
+    try: return await asyncio.wait_for(asyncio.shield(fut), AI_TIMEOUT)
+    except Exception: err = True; raise
+    finally: observe("ai", getattr(fn, "__name__", "call"), time.perf_counter() - t0, err)
+
+async def ai_upload(path):
+    """Sobe a mídia e espera o processamento sem travar o loop (antes era time.sleep no handler)."""
+    f = await ai_call(genai.upload_file, path); deadline = time.monotonic() + AI_TIMEOUT
+    while f.state.name == "PROCESSING":
+        if time.monotonic() > deadline: raise asyncio.TimeoutError()
+        await asyncio.sleep(1); f = await ai_call(genai.get_file, f.name)
+    return f
+
+def ai_discard_done(fut):
+    if not fut.cancelled() and fut.exception(): logger.warning(f"Falha ao apagar upload do Gemini: {fut.exception()!r}")
+
+def ai_discard(f):
+    # Remove o upload do Gemini em segundo plano; falha aqui não interessa ao usuário, só ao log
+    asyncio.get_running_loop().run_in_executor(AI_POOL, genai.delete_file, f.name).add_done_callback(ai_discard_done)
 
 # ================= 4. BANCO DE DADOS =================
-def load_db():
-    default = {
+# DB_MODE=journal (padrão): cada alteração vira uma linha no JOURNAL_FILE e o snapshot só é
+# regravado pela compactação em segundo plano. DB_MODE=json: regrava o arquivo inteiro (legado).
+# DB_MODE=sqlite: tabelas indexadas em SQLITE_FILE (migradas do JSON na primeira execução).
+DB_MODE = os.getenv("DB_MODE", "journal").lower()
+JOURNAL_FILE = DB_FILE.replace(".json", ".journal")
+SQLITE_FILE = os.getenv("SQLITE_FILE", DB_FILE.replace(".json", ".sqlite3"))
+JOURNAL_MAX = int(os.getenv("JOURNAL_MAX", "5000"))
+
+def default_db():
+    return {
         "transactions": [], "shopping_list": [], "debts_v2": {},
         "categories": {"ganho": ["Salário", "Extra", "Vendas/IPTV"], "gasto": ["Alimentação", "Transporte", "Lazer", "Mercado", "Casa"]},
         "vip_users": {}, "config": {"panic_mode": False, "persona": "padrao"}, "reminders": [], "subscriptions": [],
         "iptv_clients": [], "goals": [], "achievements": []
     }
-    if not os.path.exists(DB_FILE): return default
+
+def fix_db(data):
+    if "iptv_clients" not in data: data["iptv_clients"] = []
+    if "goals" not in data: data["goals"] = []
+    if "achievements" not in data: data["achievements"] = []
+    if "subscriptions" not in data: data["subscriptions"] = []
+    if "reminders" not in data: data["reminders"] = []
+    for k, v in default_db().items(): data.setdefault(k, v)  # partições (TENANTS) só têm parte das chaves
+    if "Vendas/IPTV" not in data["categories"]["ganho"]: data["categories"]["ganho"].append("Vendas/IPTV")
+    return data
+
+# ---- Transação compacta ----
+TX_TYPES = ["ganho", "gasto"]  # kind = índice nesta lista; tipos desconhecidos ganham um código novo
+TX_KEYS = ("id", "type", "value", "category", "description", "date")
+
+def type_code(s):
+    s = str(s).lower()
+    try: return TX_TYPES.index(s)
+    except ValueError: TX_TYPES.append(s); return len(TX_TYPES) - 1
+
+def parse_ts(s):
+    """ "dd/mm/aaaa HH:MM" -> minutos desde 01/01/0001 (ordinal * 1440 + minuto do dia), ou None."""
+    try:
+        if s[2] != "/" or s[5] != "/": return None
+        return date(int(s[6:10]), int(s[3:5]), int(s[:2])).toordinal() * 1440 + int(s[11:13] or 0) * 60 + int(s[14:16] or 0)
+    except (ValueError, TypeError, IndexError): return None
+
+def to_ts(dt): return dt.toordinal() * 1440 + dt.hour * 60 + dt.minute if isinstance(dt, datetime) else dt.toordinal() * 1440
+
+def ts_date(ts): return date.fromordinal(ts // 1440)
+
+class Tx:
+    """Transação em memória: data convertida uma vez para `ts`, tipo como int, textos internados.
+    Responde como o dict antigo (t['value'], t.get('description')) e to_dict() devolve o formato do JSON."""
+    __slots__ = ("id", "kind", "value", "category", "description", "ts", "extra")
+
+    def __init__(self, id, kind, value, category, description, ts, extra=None):
+        self.id, self.kind, self.value, self.category, self.description, self.ts, self.extra = id, kind, value, category, description, ts, extra
+
+    @classmethod
+    def from_dict(cls, d):
+        raw = d.get("date"); ts = parse_ts(raw) if raw else None
+        extra = {k: v for k, v in d.items() if k not in TX_KEYS} or None
+        if raw is not None and (ts is None or len(raw) != 16): extra = dict(extra or {}, date=raw)  # guarda o texto original
+        desc = d.get("description")
+        return cls(d.get("id"), type_code(d.get("type", "")), d.get("value", 0), sys.intern(str(d.get("category", ""))),
+                   sys.intern(desc) if isinstance(desc, str) else desc, ts, extra)
+
+    @property
+    def type(self): return TX_TYPES[self.kind]
+
+    @property
+    def date(self):
+        if self.extra and "date" in self.extra: return self.extra["date"]
+        if self.ts is None: return ""
+        d = ts_date(self.ts); h, mi = divmod(self.ts % 1440, 60)
+        return f"{d.day:02d}/{d.month:02d}/{d.year} {h:02d}:{mi:02d}"
+
+    def to_dict(self):
+        d = {"id": self.id, "type": self.type, "value": self.value, "category": self.category}
+        if self.description is not None: d["description"] = self.description
+        if self.extra: d.update(self.extra)
+        if self.ts is not None or "date" in d: d["date"] = self.date
+        return d
+
+    def __getitem__(self, k):
+        if k in ("id", "value", "category"): return getattr(self, k)
+        if k == "type": return self.type
+        if k == "date": return self.date
+        if k == "description" and self.description is not None: return self.description
+        if self.extra and k in self.extra: return self.extra[k]
+        raise KeyError(k)
+
+    def get(self, k, default=None):
+        try: return self[k]
+        except KeyError: return default
+
+def tx_json(o):
+    if isinstance(o, Tx): return o.to_dict()
+    raise TypeError(type(o).__name__)
+
+def read_snapshot(path):
+    if not os.path.exists(path): return default_db()
     try:
-        with open(DB_FILE, "r") as f: 
-            data = json.load(f)
-            if "iptv_clients" not in data: data["iptv_clients"] = []
-            if "goals" not in data: data["goals"] = []
-            if "achievements" not in data: data["achievements"] = []
-            if "subscriptions" not in data: data["subscriptions"] = []
-            if "reminders" not in data: data["reminders"] = []
-            if "Vendas/IPTV" not in data["categories"]["ganho"]: data["categories"]["ganho"].append("Vendas/IPTV")
-            return data
-    except: return default
-
-def save_db(data):
-    with open(DB_FILE, "w") as f: json.dump(data, f, indent=2)
-
-db = load_db()
+        with open(path, "r") as f: return fix_db(json.load(f))
+    except: return default_db()
+
+def write_snapshot(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2, default=tx_json); f.flush(); os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def apply_record(data, rec):
+    op = rec.get("op")
+    if op == "add": data["transactions"].append(rec["t"])
+    elif op == "add_many": data["transactions"].extend(rec["ts"])
+    elif op == "del": data["transactions"] = [t for t in data["transactions"] if t["id"] != rec["id"]]
+    elif op == "del_many": ids = set(rec["ids"]); data["transactions"] = [t for t in data["transactions"] if t["id"] not in ids]
+    elif op == "set": data[rec["k"]] = rec["v"]
+
+class JsonStore:
+    """Legado: todo commit regrava o JSON completo. Mantém uma réplica própria (alimentada pelos
+    registros) para que a thread de escrita nunca leia o `db` que os handlers estão mexendo."""
+    def __init__(self, path=DB_FILE): self.path = path
+    def load(self): self.data = read_snapshot(self.path); return read_snapshot(self.path)
+    def read(self): return read_snapshot(self.path)
+    def write(self, rec): apply_record(self.data, rec)
+    def commit(self): write_snapshot(self.path, self.data)
+    def close(self): pass
+
+class JournalStore:
+    """Snapshot (DB_FILE) + log append-only (JOURNAL_FILE), um registro JSON por linha.
+    Ao passar de JOURNAL_MAX linhas o log é rotacionado para .1 e uma thread funde
+    snapshot + .1 num snapshot novo. O campo "_seq" do snapshot diz até qual registro
+    ele já contém, então o replay é idempotente mesmo se a compactação cair no meio."""
+    def __init__(self, path, log, inline=False):
+        self.path, self.log, self.old, self.inline = path, log, log + ".1", inline  # inline: compacta na própria thread
+        self.seq = 0; self.count = 0; self.f = None; self.compactor = None
+
+    @staticmethod
+    def replay(data, path, base):
+        """Aplica em `data` os registros de `path` posteriores a `base`. Retorna (linhas, último seq)."""
+        n, seq = 0, base
+        if not os.path.exists(path): return n, seq
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try: rec = json.loads(line)
+                except ValueError: continue  # linha cortada por queda no meio da escrita
+                n += 1
+                if rec.get("n", 0) <= base: continue
+                apply_record(data, rec); seq = max(seq, rec["n"])
+        return n, seq
+
+    def read(self):
+        data = read_snapshot(self.path); base = data.pop("_seq", 0)
+        _, seq = self.replay(data, self.old, base); self.count, self.seq = self.replay(data, self.log, seq)
+        return data
+
+    def load(self):
+        data = self.read(); self.f = open(self.log, "a", encoding="utf-8")
+        if self.count >= JOURNAL_MAX: self.rotate()
+        return data
+
+    def write(self, rec):
+        self.seq += 1; rec["n"] = self.seq
+        self.f.write(json.dumps(rec, ensure_ascii=False) + "\n"); self.count += 1
+
+    def commit(self):
+        self.f.flush(); os.fsync(self.f.fileno())
+        if self.count >= JOURNAL_MAX: self.rotate()
+
+    def rotate(self):
+        if self.compactor and self.compactor.is_alive(): return
+        if os.path.exists(self.old): return self.start_compaction()  # compactação anterior não terminou
+        self.f.close(); os.replace(self.log, self.old)
+        self.f = open(self.log, "a", encoding="utf-8"); self.count = 0
+        self.start_compaction()
+
+    def start_compaction(self):
+        if self.inline: return self.compact()
+        self.compactor = threading.Thread(target=self.compact, daemon=True); self.compactor.start()
+
+    def close(self):
+        """Write-back ao descarregar a partição: snapshot + logs viram um snapshot só."""
+        self.f.close()
+        if self.compactor: self.compactor.join()
+        if self.count or os.path.exists(self.old):
+            data = self.read(); data["_seq"] = self.seq; write_snapshot(self.path, data)
+            for p in (self.old, self.log):
+                if os.path.exists(p): os.remove(p)
+
+    def compact(self):
+        try:
+            t0 = time.perf_counter(); data = read_snapshot(self.path)
+            _, data["_seq"] = self.replay(data, self.old, data.pop("_seq", 0))
+            write_snapshot(self.path, data); os.remove(self.old)
+            logger.info(f"Journal compactado em {time.perf_counter() - t0:.2f}s")
+        except Exception as e: logger.error(f"Falha na compactação: {e}")
+
+SQL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (id TEXT, type TEXT, value REAL, category TEXT, description TEXT,
+    date TEXT, month TEXT, day INTEGER, extra TEXT);
+-- relatórios saem do ROLLUP: índices por tipo/mês e categoria só encareciam os inserts
+DROP INDEX IF EXISTS ix_tr_type_month;
+DROP INDEX IF EXISTS ix_tr_category;
+CREATE INDEX IF NOT EXISTS ix_tr_id ON transactions(id);
+CREATE TABLE IF NOT EXISTS iptv_clients (id TEXT PRIMARY KEY, name TEXT, phone TEXT, day INTEGER, value REAL);
+CREATE INDEX IF NOT EXISTS ix_iptv_day ON iptv_clients(day);
+CREATE TABLE IF NOT EXISTS debts (name TEXT PRIMARY KEY, value REAL);
+CREATE TABLE IF NOT EXISTS reminders (text TEXT, time TEXT, chat_id INTEGER);
+CREATE INDEX IF NOT EXISTS ix_rem_time ON reminders(time);
+CREATE TABLE IF NOT EXISTS subscriptions (name TEXT, val REAL, day INTEGER);
+CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT);
+"""
+TR_COLS = ("id", "type", "value", "category", "description", "date")
+
+def tr_row(t):
+    d = t.get("date", ""); extra = {k: v for k, v in t.items() if k not in TR_COLS}
+    try: day = int(d[:2])
+    except ValueError: day = None
+    return (t.get("id"), str(t.get("type", "")).lower(), t.get("value", 0), t.get("category"), t.get("description"),
+            d, d[3:10], day, json.dumps(extra) if extra else None)
+
+class SqliteStore:
+    """Uma linha por transação/cliente/lembrete; o resto do dict fica na tabela kv.
+    O `db` em memória continua existindo para os handlers, os relatórios consultam o SQL."""
+    def __init__(self, path, src=DB_FILE): self.path = path; self.src = src; self.con = None  # src: JSON importado na criação
+
+    def open(self):
+        self.con = sqlite3.connect(self.path, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode=WAL"); self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.executescript(SQL_SCHEMA)
+        return self.con
+
+    def load(self):
+        fresh = not os.path.exists(self.path); self.open()
+        if fresh and self.src and os.path.exists(self.src):
+            n = self.import_data(JournalStore(self.src, self.src.replace(".json", ".journal")).read())
+            logger.info(f"SQLite criado a partir de {self.src}: {n} transações")
+        return self.read()
+
+    def read(self):
+        q = self.con.execute; data = default_db()
+        for k, v in q("SELECT key, value FROM kv"): data[k] = json.loads(v)
+        data["transactions"] = []
+        for tid, tp, val, cat, desc, when, extra in q("SELECT id, type, value, category, description, date, extra FROM transactions ORDER BY rowid"):
+            t = {"id": tid, "type": tp, "value": val, "category": cat, "description": desc, "date": when}
+            if desc is None: del t["description"]
+            if extra: t.update(json.loads(extra))
+            data["transactions"].append(t)
+        data["iptv_clients"] = [{"id": i, "name": n, "phone": p, "day": d, "value": v} for i, n, p, d, v in q("SELECT id, name, phone, day, value FROM iptv_clients ORDER BY rowid")]
+        data["debts_v2"] = {n: v for n, v in q("SELECT name, value FROM debts ORDER BY rowid")}
+        data["reminders"] = [{"text": t, "time": tm, "chat_id": c} for t, tm, c in q("SELECT text, time, chat_id FROM reminders ORDER BY rowid")]
+        data["subscriptions"] = [{"name": n, "val": v, "day": d} for n, v, d in q("SELECT name, val, day FROM subscriptions ORDER BY rowid")]
+        return fix_db(data)
+
+    def import_data(self, data):
+        with self.con:
+            self.con.executemany("INSERT INTO transactions VALUES (?,?,?,?,?,?,?,?,?)", (tr_row(t) for t in data["transactions"]))
+            for k in data:
+                if k != "transactions": self.put(k, data[k])
+        return len(data["transactions"])
+
+    def put(self, k, v):
+        x = self.con.execute
+        if k == "iptv_clients":
+            x("DELETE FROM iptv_clients")
+            self.con.executemany("INSERT OR REPLACE INTO iptv_clients VALUES (?,?,?,?,?)", [(c["id"], c["name"], c.get("phone"), int(c["day"]), c.get("value", 0)) for c in v])
+        elif k == "debts_v2":
+            x("DELETE FROM debts"); self.con.executemany("INSERT INTO debts VALUES (?,?)", list(v.items()))
+        elif k == "reminders":
+            x("DELETE FROM reminders"); self.con.executemany("INSERT INTO reminders VALUES (?,?,?)", [(r["text"], r["time"], r.get("chat_id")) for r in v])
+        elif k == "subscriptions":
+            x("DELETE FROM subscriptions"); self.con.executemany("INSERT INTO subscriptions VALUES (?,?,?)", [(s["name"], s["val"], s["day"]) for s in v])
+        else: x("INSERT OR REPLACE INTO kv VALUES (?, ?)", (k, json.dumps(v)))
+
+    def write(self, rec):
+        op = rec["op"]
+        if op == "add": self.con.execute("INSERT INTO transactions VALUES (?,?,?,?,?,?,?,?,?)", tr_row(rec["t"]))
+        elif op == "add_many": self.con.executemany("INSERT INTO transactions VALUES (?,?,?,?,?,?,?,?,?)", [tr_row(t) for t in rec["ts"]])
+        elif op == "del": self.con.execute("DELETE FROM transactions WHERE id = ?", (rec["id"],))
+        elif op == "del_many": self.con.executemany("DELETE FROM transactions WHERE id = ?", [(i,) for i in rec["ids"]])
+        elif op == "set": self.put(rec["k"], rec["v"])
+
+    def commit(self): self.con.commit()
+
+    def close(self): self.con.commit(); self.con.close()
+
+    def rollup_rows(self):
+        """Linhas já agregadas para montar o ROLLUP sem trazer as transações para o Python."""
+        return self.con.execute("SELECT month, type, category, COALESCE(description, category), day, SUM(value), COUNT(*) "
+                                "FROM transactions GROUP BY 1, 2, 3, 4, 5")
+
+def migrate_to_sqlite():
+    """Migração avulsa: python main.py --migrate-sqlite (lê JSON + journal, recria SQLITE_FILE)."""
+    if os.path.exists(SQLITE_FILE): os.replace(SQLITE_FILE, SQLITE_FILE + ".bak")
+    store = SqliteStore(SQLITE_FILE); store.open()
+    n = store.import_data(JournalStore(DB_FILE, JOURNAL_FILE).read())
+    print(f"✅ {n} transações migradas para {SQLITE_FILE}")
+
+# TENANTS=1: cada usuário tem sua partição (TENANT_DIR/user_<id>.json/.journal/.sqlite3), carregada
+# quando ele fala com o bot e mantida num LRU de TENANT_MAX; vip_users e config ficam na partição
+# global (GLOBAL_BASE). O admin fica sempre carregado (agendador, alertas e backup usam os dados dele).
+TENANT_MODE = os.getenv("TENANTS") == "1"
+TENANT_DIR = os.getenv("TENANT_DIR", "tenants")
+TENANT_MAX = int(os.getenv("TENANT_MAX", "64"))
+GLOBAL_BASE = os.getenv("GLOBAL_BASE", "global_v119")
+GLOBAL_KEYS = ("vip_users", "config")
+
+def make_store(base):
+    """Store de uma partição: base.json (+ .journal) ou base.sqlite3 (criado a partir do base.json)."""
+    if DB_MODE == "journal": return JournalStore(base + ".json", base + ".journal", inline=True)
+    if DB_MODE == "sqlite": return SqliteStore(base + ".sqlite3", src=base + ".json")
+    return JsonStore(base + ".json")
+
+if TENANT_MODE: STORE = make_store(GLOBAL_BASE)
+else: STORE = {"journal": lambda: JournalStore(DB_FILE, JOURNAL_FILE), "sqlite": lambda: SqliteStore(SQLITE_FILE)}.get(DB_MODE, JsonStore)()
+
+# Saldo corrente: somas por tipo mantidas a cada add/remove, reconstruídas uma vez no load_db.
+# VERIFY_STATS=1 confere contra a varredura completa a cada calc_stats (debug).
+VERIFY_STATS = os.getenv("VERIFY_STATS") == "1"
+TOTALS = {"ganho": 0.0, "gasto": 0.0}
+
+def scan_totals(trans):
+    tot = {"ganho": 0.0, "gasto": 0.0}
+    for t in trans:
+        k = t.type
+        if k in tot: tot[k] += t.value
+    return tot
+
+# ROLLUP["MM/AAAA"][tipo] = {"total": [v, n], "cat": {cat: [v, n]}, "desc": {desc: [v, n]}, "day": {dia: [v, n]}}
+# Os relatórios só leem daqui; o n (quantidade) permite remover chaves que zeraram.
+ROLLUP = {}
+ROLLUP_VER = {}  # mês -> versão (chave do cache de gráficos e da projeção)
+ROLLUP_SEQ = itertools.count(1)  # global: uma partição recarregada nunca repete a versão de antes do despejo
+
+def bump(d, k, v, n):
+    e = d.get(k)
+    if e is None: e = d[k] = [0.0, 0]
+    e[0] += v; e[1] += n
+    if e[1] <= 0: del d[k]
+
+def rollup_add(m, kind, cat, desc, day, v, n):
+    r = ROLLUP.setdefault(m, {}).setdefault(kind, {"total": [0.0, 0], "cat": {}, "desc": {}, "day": {}})
+    ROLLUP_VER[m] = next(ROLLUP_SEQ)
+    r["total"][0] += v; r["total"][1] += n
+    bump(r["cat"], cat, v, n); bump(r["desc"], desc, v, n); bump(r["day"], day, v, n)
+
+def rollup_track(t, sign):
+    if t.ts is None: return
+    d = ts_date(t.ts)
+    rollup_add(f"{d.month:02d}/{d.year}", t.type, t.category, t.category if t.description is None else t.description, d.day, sign * t.value, sign)
+
+def rebuild_rollup(data):
+    ROLLUP.clear()
+    if isinstance(STORE, SqliteStore):
+        for row in STORE.rollup_rows(): rollup_add(*row)
+    else:
+        for t in data["transactions"]: rollup_track(t, 1)
+
+@timed("storage")
+def load_db():
+    data = STORE.load(); data["transactions"] = [Tx.from_dict(t) for t in data["transactions"]]
+    TOTALS.update(scan_totals(data["transactions"])); rebuild_rollup(data)
+    return data
+
+# ---- Escritor único ----
+# Só a thread StorageWriter toca no STORE: os handlers (todos no event loop) mudam o `db` em memória e
+# enfileiram registros já serializáveis; o escritor aplica na ordem e faz um único flush/fsync por
+# janela de GROUP_COMMIT_MS, juntando rajadas de save_db.
+GROUP_COMMIT_MS = float(os.getenv("GROUP_COMMIT_MS", "20"))
+
+# ---- Backup incremental: registros desde o último backup ----
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_FULL_DAYS = int(os.getenv("BACKUP_FULL_DAYS", "7"))
+MANIFEST_FILE = os.path.join(BACKUP_DIR, "manifest.json")
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""): h.update(chunk)
+    return h.hexdigest()
+
+class DeltaLog:
+    """Cópia (feita pelo StorageWriter) de cada registro gravado desde o último backup.
+    cut() fecha o arquivo pendente como delta_<stamp>.jsonl.gz e começa outro vazio."""
+    def __init__(self, folder):
+        os.makedirs(folder, exist_ok=True); self.folder = folder
+        self.path = os.path.join(folder, "pending.jsonl"); self.f = open(self.path, "a", encoding="utf-8")
+
+    def write(self, rec): self.f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+    def flush(self): self.f.flush()
+
+    def cut(self, stamp):
+        self.f.close(); entry = None
+        if os.path.getsize(self.path):
+            name = f"delta_{stamp}.jsonl.gz"; out = os.path.join(self.folder, name); n = 0
+            with open(self.path, "rb") as src, gzip.open(out, "wb") as dst:
+                for line in src: dst.write(line); n += 1
+            entry = {"file": name, "sha256": sha256_file(out), "records": n, "date": stamp}
+        os.remove(self.path); self.f = open(self.path, "a", encoding="utf-8")
+        return entry
+
+class StorageWriter(threading.Thread):
+    def __init__(self, store, delta=None):
+        super().__init__(name="storage-writer", daemon=True)
+        self.store = store; self.delta = delta; self.q = queue.Queue(); self.commits = 0
+        self.stores = {}  # modo TENANTS: uid -> store das partições carregadas (registros com "u")
+
+    def cut(self, stamp, snap=None):
+        """Fecha o delta de backup na ordem da fila: tudo que foi enfileirado antes entra nele.
+        Com `snap`, o resultado é (delta, snap(self)), lido nesse mesmo ponto da fila."""
+        fut = Future(); self.submit({"op": "cut", "stamp": stamp, "snap": snap, "fut": fut}); return fut
+
+    def open(self, uid):
+        """Carrega a partição de `uid` (Future com o dict) depois de tudo que já está na fila."""
+        fut = Future(); self.submit({"op": "open", "u": uid, "fut": fut}); return fut
+
+    def release(self, uid): self.submit({"op": "close", "u": uid})
+
+    def submit(self, rec): self.q.put(rec)
+
+    def control(self, rec):
+        op = rec["op"]; u = rec.get("u")
+        if op == "cut":
+            self.delta.flush(); entry = self.delta.cut(rec["stamp"])
+            return (entry, rec["snap"](self)) if rec["snap"] else entry
+        old = self.stores.pop(u, None)
+        if old: old.close()
+        if op == "open":
+            store = make_store(tenant_base(u)); data = store.load(); self.stores[u] = store; return data
+
+    def run(self):
+        stop = False
+        while not stop:
+            batch = [self.q.get()]; end = time.monotonic() + GROUP_COMMIT_MS / 1000
+            while (left := end - time.monotonic()) > 0:
+                try: batch.append(self.q.get(timeout=left))
+                except queue.Empty: break
+            dirty = {}
+            for rec in batch:
+                if rec is None: stop = True; continue
+                if rec["op"] in ("cut", "open", "close"):
+                    self.commit(dirty); dirty = {}  # o que veio antes na fila já está no disco
+                    try: res = self.control(rec)
+                    except Exception as e:
+                        logger.error(f"Falha em {rec['op']}: {e}")
+                        if "fut" in rec: rec["fut"].set_exception(e)
+                    else:
+                        if "fut" in rec: rec["fut"].set_result(res)
+                    continue
+                try:
+                    u = rec.get("u"); store = self.store if u is None else self.stores[u]
+                    if rec["op"] != "commit":
+                        store.write(rec)
+                        if self.delta: self.delta.write(rec)
+                    dirty[id(store)] = store
+                except Exception as e: logger.error(f"Falha ao gravar {rec.get('op')}: {e}")
+            self.commit(dirty)
+
+    def commit(self, dirty):
+        if not dirty: return
+        t0 = time.perf_counter(); err = False
+        try:
+            for store in dirty.values(): store.commit()
+            self.commits += 1
+            if self.delta: self.delta.flush()
+        except Exception as e: logger.error(f"Falha no commit: {e}"); err = True
+        observe("storage", "commit", time.perf_counter() - t0, err)
+
+    def close(self):
+        """Grava o que estiver na fila e encerra (chamado no shutdown)."""
+        if self.is_alive():
+            self.q.put(None); self.join(timeout=30)
+            for store in self.stores.values(): store.close()
+
+@timed("storage")
+def save_db(data, *keys):
+    """Persiste as seções `keys` de `data` (transações são gravadas por add/remove_transaction)."""
+    if TENANT_MODE and "reminders" in keys:
+        index_reminders(data)
+        if "config" not in keys: keys += ("config",)
+    for k in keys: WRITER.submit(tenant_tag({"op": "set", "k": k, "v": json.loads(json.dumps(data[k]))}, k))  # cópia: o escritor roda em outra thread
+    WRITER.submit(tenant_tag({"op": "commit"}))
+
+def track(t, sign):
+    k = t.type
+    if k in TOTALS: TOTALS[k] += sign * t.value
+    rollup_track(t, sign)
+    if sign > 0: TXINDEX.add(t)
+    else: TXINDEX.remove(t)
+
+def add_transaction(t):
+    if isinstance(t, dict): t = Tx.from_dict(t)
+    db["transactions"].append(t); WRITER.submit(tenant_tag({"op": "add", "t": t.to_dict()})); track(t, 1)
+
+def remove_transaction(tid):
+    trans = db["transactions"]
+    for i in range(len(trans) - 1, -1, -1):
+        if trans[i].id == tid:
+            track(trans[i], -1); del trans[i]; WRITER.submit(tenant_tag({"op": "del", "id": tid})); return True
+    return False
+
+def add_transactions(ts):
+    """Lote (importação): um único registro add_many no log/SQLite em vez de um por transação."""
+    ts = [t if isinstance(t, Tx) else Tx.from_dict(t) for t in ts]
+    if not ts: return ts
+    db["transactions"].extend(ts); WRITER.submit(tenant_tag({"op": "add_many", "ts": [t.to_dict() for t in ts]}))
+    for t in ts: track(t, 1)
+    return ts
+
+def remove_transactions(ids):
+    ids = set(ids); trans = db["transactions"]; keep = []
+    for t in trans:
+        if t.id in ids: track(t, -1)
+        else: keep.append(t)
+    n = len(trans) - len(keep); trans[:] = keep  # mesma lista: TXINDEX e o db seguem apontando para ela
+    if n: WRITER.submit(tenant_tag({"op": "del_many", "ids": sorted(ids)}))
+    return n
+
+# ---- Registro IPTV ----
+def due_day(day, y, m): return min(day, calendar.monthrange(y, m)[1])  # dia 31 em fevereiro vence no dia 28/29
+
+REGISTRY_VER = itertools.count(1)  # versão global (única entre tenants): muda a cada alteração de cliente
+
+class IptvRegistry:
+    """Índices sobre db["iptv_clients"]: id -> cliente e dia do mês -> clientes (com a soma dos planos
+    por dia). A lista do db continua sendo o que é gravado; add/update/remove mantêm tudo em sincronia."""
+    def __init__(self, clients): self.rebuild(clients)
+
+    def rebuild(self, clients):
+        self.ver = next(REGISTRY_VER); self.clients = clients; self.by_id = {}; self.by_day = {d: [] for d in range(1, 32)}
+        self.day_sum = [0.0] * 32; self.total = 0.0; self._sorted = None
+        for c in clients: self.index(c, 1)
+
+    @staticmethod
+    def day_of(c):
+        try: return min(max(int(c["day"]), 1), 31)
+        except (KeyError, TypeError, ValueError): return None
+
+    def index(self, c, sign):
+        try: v = float(c.get("value", 0) or 0)
+        except (TypeError, ValueError): v = 0.0
+        self.total += sign * v; self._sorted = None; self.ver = next(REGISTRY_VER)
+        if sign > 0: self.by_id[c["id"]] = c
+        else: self.by_id.pop(c["id"], None)
+        d = self.day_of(c)
+        if d is None: return
+        if sign > 0: self.by_day[d].append(c)
+        else: self.by_day[d] = [x for x in self.by_day[d] if x is not c]
+        self.day_sum[d] += sign * v
+
+    def get(self, cid): return self.by_id.get(cid)
+
+    def add(self, c): self.clients.append(c); self.index(c, 1)
+
+    def update(self, cid, field, val):
+        c = self.by_id.get(cid)
+        if c: self.index(c, -1); c[field] = val; self.index(c, 1)
+        return c
+
+    def remove(self, cid):
+        c = self.by_id.get(cid)
+        if not c: return None
+        self.index(c, -1)
+        for i, x in enumerate(self.clients):
+            if x is c: del self.clients[i]; break
+        return c
+
+    def sorted(self):
+        if self._sorted is None: self._sorted = sorted(self.clients, key=lambda c: self.day_of(c) or 32)
+        return self._sorted
+
+    def days_for(self, d):
+        """Dias de vencimento que caem na data `d` (no último dia do mês entram também os dias que não existem)."""
+        last = calendar.monthrange(d.year, d.month)[1]
+        return range(d.day, 32) if d.day == last else (d.day,)
+
+    def due_on(self, d): return [c for day in self.days_for(d) for c in self.by_day[day]]
+
+    def sum_on(self, d): return sum(self.day_sum[day] for day in self.days_for(d))
+
+    def next_due(self, c, today):
+        """Próximo vencimento a partir de hoje (inclusive)."""
+        day = self.day_of(c) or 1; y, m = today.year, today.month
+        if due_day(day, y, m) < today.day: y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+        return date(y, m, due_day(day, y, m))
+
+    def last_due(self, c, today):
+        """Último vencimento até hoje (inclusive)."""
+        day = self.day_of(c) or 1; y, m = today.year, today.month
+        if due_day(day, y, m) > today.day: y, m = (y - 1, 12) if m == 1 else (y, m - 1)
+        return date(y, m, due_day(day, y, m))
+
+    def forecast(self, today, days):
+        """Receita que vence de amanhã até hoje + `days`: no máximo `days` somas de buckets."""
+        return sum(self.sum_on(today + timedelta(days=k)) for k in range(1, days + 1))
+
+# ---- Índice do extrato ----
+WORD_RE = re.compile(r"\w+")
+
+def content_hash(day, value, kind, desc):
+    """Identidade de conteúdo (dia, valor, tipo, descrição normalizada) em 8 bytes, para deduplicar importações."""
+    return hashlib.blake2b(f"{day}|{float(value):.2f}|{kind}|{' '.join(WORD_RE.findall((desc or '').lower()))}".encode(), digest_size=8).digest()
+
+def tx_hash(t): return content_hash(None if t.ts is None else t.ts // 1440, t.value, t.kind, t.description)
+
+class TxIndex:
+    """Transações em ordem de data (chave (ts, seq)) + índice invertido palavra/categoria -> transações.
+    Montado na primeira consulta e mantido por track(); a paginação é por cursor (a chave do último
+    item mostrado), então qualquer página sai por bisect sem percorrer o histórico."""
+    def __init__(self, trans): self.trans = trans; self.ready = False
+
+    def build(self):
+        self.keys = {}; self.by_key = {}; self.by_id = {}; self.words = {}; self.cats = {}; self.hashes = Counter(); self.seq = itertools.count()
+        for t in self.trans: self.index(t)
+        self.entries = sorted(self.by_key); self.ready = True
+
+    def index(self, t):
+        k = self.keys[t] = (-1 if t.ts is None else t.ts, next(self.seq)); self.by_key[k] = t; self.by_id[t.id] = t
+        for w in set(WORD_RE.findall((t.description or "").lower())): self.words.setdefault(w, set()).add(t)
+        self.cats.setdefault(t.category.lower(), set()).add(t)
+        self.hashes[tx_hash(t)] += 1
+        return k
+
+    def add(self, t):
+        if self.ready: bisect.insort(self.entries, self.index(t))
+
+    def remove(self, t):
+        if not self.ready or t not in self.keys: return
+        k = self.keys.pop(t); del self.by_key[k]; del self.entries[bisect.bisect_left(self.entries, k)]
+        if self.by_id.get(t.id) is t: del self.by_id[t.id]
+        for w in set(WORD_RE.findall((t.description or "").lower())): self.words.get(w, set()).discard(t)
+        self.cats.get(t.category.lower(), set()).discard(t)
+        h = tx_hash(t); self.hashes[h] -= 1
+        if self.hashes[h] <= 0: del self.hashes[h]
+
+    def get(self, tid):
+        if not self.ready: self.build()
+        return self.by_id.get(tid)
+
+    def match(self, word):
+        """Palavra exata ou, se não houver, todas que começam com ela ("merc" -> mercado, mercadinho)."""
+        if word in self.words: return self.words[word]
+        return set().union(*(s for w, s in self.words.items() if w.startswith(word)))
+
+    def page(self, cursor=None, older=True, words=(), category=None, kind=None, start=None, end=None, size=8):
+        """Até `size` transações (mais novas primeiro) antes (older) ou depois do cursor.
+        Retorna (itens, tem_mais_antigos, tem_mais_novos)."""
+        if not self.ready: self.build()
+        cands = None
+        for s in sorted([self.match(w) for w in words] + ([self.cats.get(category.lower(), set())] if category else []), key=len):
+            cands = set(s) if cands is None else cands & s
+        keys = self.entries
+        if cands is not None and len(cands) < len(keys) // 8:
+            keys = sorted(self.keys[t] for t in cands); cands = None  # poucos candidatos: ordena só eles
+        lo = 0 if start is None else bisect.bisect_left(keys, (start, -1))
+        hi = len(keys) if end is None else bisect.bisect_left(keys, (end, -1))
+        if cursor is not None:
+            if older: hi = min(hi, bisect.bisect_left(keys, cursor))
+            else: lo = max(lo, bisect.bisect_right(keys, cursor))
+        ok = lambda t: (kind is None or t.kind == kind) and (cands is None or t in cands)
+        out = []; rng = range(hi - 1, lo - 1, -1) if older else range(lo, hi)
+        for i in rng:
+            t = self.by_key[keys[i]]
+            if ok(t):
+                out.append(t)
+                if len(out) > size: break
+        more = len(out) > size; out = out[:size]
+        if not older: out.reverse()
+        return out, (more if older else True), (cursor is not None if older else more)
+
+    def key(self, t): return self.keys.get(t)
+
+# ---- Partições por usuário (TENANTS=1) ----
+CURRENT = contextvars.ContextVar("tenant", default=None)  # tenant do handler/tarefa em execução
+TENANTS = None
+
+def tenant_base(uid): return os.path.join(TENANT_DIR, f"user_{uid}")
+
+def tenant_ids():
+    if not os.path.isdir(TENANT_DIR): return set()
+    return {n[5:].split(".")[0] for n in os.listdir(TENANT_DIR) if n.startswith("user_")}
+
+def tenant_dir_size():
+    total = 0
+    for e in os.scandir(TENANT_DIR) if os.path.isdir(TENANT_DIR) else ():
+        try: total += e.stat().st_size if e.name.startswith("user_") else 0
+        except FileNotFoundError: pass  # compactação trocou o arquivo no meio da varredura
+    return total
+
+def tenant_id(): return TENANTS.current().uid if TENANT_MODE else None
+
+def tenant_tag(rec, key=None):
+    """Registros de chaves não globais vão para a partição do tenant atual."""
+    if TENANT_MODE and key not in GLOBAL_KEYS: rec["u"] = TENANTS.current().uid
+    return rec
+
+def rem_when(rem):
+    try: return datetime.strptime(rem["time"], "%Y-%m-%d %H:%M")
+    except (KeyError, TypeError, ValueError): return None
+
+def index_reminders(data, uid=None):
+    """config["reminder_due"][uid] = lembrete mais próximo: o agendador acorda a partição só nessa hora."""
+    idx = data["config"].setdefault("reminder_due", {}); uid = uid or tenant_id()
+    times = [w for w in map(rem_when, data["reminders"]) if w]
+    if times: idx[uid] = min(times).strftime("%Y-%m-%d %H:%M")
+    else: idx.pop(uid, None)
+
+class Tenant:
+    """Estado em memória de uma partição: o dict (sem as chaves globais) e os índices derivados."""
+    __slots__ = ("uid", "data", "totals", "rollup", "rollup_ver", "iptv", "txindex", "refs")
+
+    def __init__(self, uid, data):
+        self.uid, self.data, self.refs = uid, data, 0
+        for k in GLOBAL_KEYS: data.pop(k, None)
+        data["transactions"] = [Tx.from_dict(t) for t in data["transactions"]]
+        self.totals = scan_totals(data["transactions"]); self.rollup = {}; self.rollup_ver = {}
+        token = CURRENT.set(self)
+        try:
+            for t in data["transactions"]: rollup_track(t, 1)
+        finally: CURRENT.reset(token)
+        self.iptv = IptvRegistry(data["iptv_clients"]); self.txindex = TxIndex(data["transactions"])
+
+class TenantCache:
+    """Partições carregadas, em LRU de no máximo `size` (o admin não sai). Só o event loop mexe aqui;
+    ler e gravar os arquivos é com o StorageWriter (open/close na fila, depois dos registros pendentes)."""
+    def __init__(self, writer, size):
+        self.writer, self.size = writer, size; self.loaded = OrderedDict(); self.loading = {}; self.default = None
+
+    def current(self): return CURRENT.get() or self.default
+
+    def pin(self, uid):
+        """Carga síncrona na partida, antes do writer rodar."""
+        store = self.writer.stores[uid] = make_store(tenant_base(uid))
+        self.default = self.loaded[uid] = Tenant(uid, store.load()); return self.default
+
+    async def get(self, uid):
+        uid = str(uid); t = self.loaded.get(uid)
+        if t: self.loaded.move_to_end(uid); return t
+        fut = self.loading.get(uid)
+        if fut is None:
+            fut = self.loading[uid] = asyncio.ensure_future(self.load(uid))
+            fut.add_done_callback(lambda _: self.loading.pop(uid, None))
+        return await asyncio.shield(fut)
+
+    async def load(self, uid):
+        t0 = time.perf_counter()
+        data = await asyncio.wrap_future(self.writer.open(uid))
+        t = self.loaded[uid] = await asyncio.to_thread(Tenant, uid, data)
+        observe("storage", "tenant_load", time.perf_counter() - t0); self.evict(); return t
+
+    def evict(self):
+        for uid in list(self.loaded):
+            if len(self.loaded) <= self.size: break
+            t = self.loaded[uid]
+            if t.refs or t is self.default: continue
+            del self.loaded[uid]; self.writer.release(uid)  # write-back e fecha no writer
+
+    @contextlib.asynccontextmanager
+    async def use(self, uid):
+        while True:
+            t = await self.get(uid)
+            if self.loaded.get(t.uid) is t: break  # despejada entre a carga e aqui: carrega de novo
+        t.refs += 1; token = CURRENT.set(t)
+        try: yield t
+        finally: CURRENT.reset(token); t.refs -= 1
+
+class TenantDict(MutableMapping):
+    """No modo TENANTS, `db`, `TOTALS`, `ROLLUP` e `ROLLUP_VER` são isto: o dict `attr` do tenant atual
+    (chaves de `shared`, no caso vip_users e config, vão para o global)."""
+    def __init__(self, attr, shared=None): self.attr = attr; self.shared = {} if shared is None else shared
+    def target(self, k): return self.shared if k in self.shared else getattr(TENANTS.current(), self.attr)
+    def __getitem__(self, k): return self.target(k)[k]
+    def __setitem__(self, k, v): self.target(k)[k] = v
+    def __delitem__(self, k): del self.target(k)[k]
+    def __iter__(self): yield from self.shared; yield from getattr(TENANTS.current(), self.attr)
+    def __len__(self): return len(self.shared) + len(getattr(TENANTS.current(), self.attr))
+
+class TenantAttr:
+    """IPTV/TXINDEX no modo TENANTS: repassa para o objeto `attr` do tenant atual."""
+    def __init__(self, attr): self.attr = attr
+    def __getattr__(self, name): return getattr(getattr(TENANTS.current(), self.attr), name)
+
+def tenant_handler(fn):
+    """Só VIP tem partição: is_vip (dados globais) vem antes de carregar, e estranho não ganha arquivo."""
+    @functools.wraps(fn)
+    async def wrapped(update, context, *args, **kwargs):
+        user = getattr(update, "effective_user", None); uid = user.id if user else ADMIN_ID
+        if not is_vip(uid)[0]:
+            if update.callback_query: await update.callback_query.answer("🚫 VIP Necessário.", show_alert=True)
+            elif update.effective_message: await update.effective_message.reply_text("🚫 VIP Necessário.")
+            return
+        async with TENANTS.use(uid): return await fn(update, context, *args, **kwargs)
+    return wrapped
+
+def peek_partition(uid):
+    """Lê uma partição que não está carregada (no writer, durante o backup)."""
+    base = tenant_base(uid)
+    if DB_MODE == "sqlite" and os.path.exists(base + ".sqlite3"):
+        s = SqliteStore(base + ".sqlite3", src=None); s.open()
+        try: return s.read()
+        finally: s.con.close()
+    return JournalStore(base + ".json", base + ".journal").read()
+
+def read_partitions(writer):
+    """Roda no StorageWriter, no ponto do corte do backup: global + todas as partições."""
+    data = {k: v for k, v in writer.store.read().items() if k in GLOBAL_KEYS}; parts = data["_tenants"] = {}
+    for uid in tenant_ids() | set(writer.stores):
+        store = writer.stores.get(uid)
+        parts[uid] = {k: v for k, v in (store.read() if store else peek_partition(uid)).items() if k not in GLOBAL_KEYS}
+    return data
+
+def migrate_to_tenants():
+    """Primeira partida com TENANTS=1: o banco único vira global (vip_users, config) + partição do admin.
+    Os arquivos antigos ficam onde estão."""
+    if os.path.exists(GLOBAL_BASE + ".json") or os.path.exists(GLOBAL_BASE + ".sqlite3"): return
+    os.makedirs(TENANT_DIR, exist_ok=True)
+    if DB_MODE == "sqlite" and os.path.exists(SQLITE_FILE):
+        s = SqliteStore(SQLITE_FILE, src=None); s.open(); data = s.read(); s.con.close()
+    else: data = JournalStore(DB_FILE, JOURNAL_FILE).read()
+    uid = str(ADMIN_ID); index_reminders(data, uid)
+    write_snapshot(tenant_base(uid) + ".json", {k: v for k, v in data.items() if k not in GLOBAL_KEYS})
+    write_snapshot(GLOBAL_BASE + ".json", {k: data[k] for k in GLOBAL_KEYS})
+    logger.info(f"Partições criadas: {len(data['transactions'])} transações para o admin ({uid})")
+
+if TENANT_MODE:
+    migrate_to_tenants(); os.makedirs(TENANT_DIR, exist_ok=True)
+    GLOBAL_DB = {k: v for k, v in STORE.load().items() if k in GLOBAL_KEYS}
+    WRITER = StorageWriter(STORE, DeltaLog(BACKUP_DIR)); TENANTS = TenantCache(WRITER, TENANT_MAX)
+    TENANTS.pin(str(ADMIN_ID))
+    db = TenantDict("data", GLOBAL_DB); TOTALS = TenantDict("totals"); ROLLUP = TenantDict("rollup"); ROLLUP_VER = TenantDict("rollup_ver")
+    IPTV = TenantAttr("iptv"); TXINDEX = TenantAttr("txindex")
+else:
+    db = load_db()
+    WRITER = StorageWriter(STORE, DeltaLog(BACKUP_DIR))
+    IPTV = IptvRegistry(db["iptv_clients"]); TXINDEX = TxIndex(db["transactions"])
+WRITER.start()
+atexit.register(WRITER.close)
+
+LOOP = None  # loop do bot, para o Flask (webhook) entregar updates de outra thread
+
+def copy_db():
+    """Cópia rasa das transações e profunda do resto; chamada no event loop, entre dois handlers."""
+    return {k: (list(v) if k == "transactions" else json.loads(json.dumps(v))) for k, v in db.items()}
 
 # ================= 5. UTILS & SCHEDULER =================
 def get_now(): return datetime.utcnow() - timedelta(hours=3)
 
 def calc_stats():
-    gan = sum(t['value'] for t in db["transactions"] if str(t['type']).lower() == 'ganho')
-    gas = sum(t['value'] for t in db["transactions"] if str(t['type']).lower() == 'gasto')
+    gan, gas = TOTALS["ganho"], TOTALS["gasto"]
+    if VERIFY_STATS:
+        full = scan_totals(db["transactions"])
+        if abs(full["ganho"] - gan) > 0.005 or abs(full["gasto"] - gas) > 0.005:
+            logger.error(f"TOTALS divergente: incremental={TOTALS} varredura={full}")
+            TOTALS.update(full); gan, gas = full["ganho"], full["gasto"]
     return (gan - gas), gas
 
 def is_vip(user_id):
@@ -117,6 +1076,7 @@ def is_vip(user_id):
     return False, "❌ Bloqueado"
 
 def restricted(func):
+    @functools.wraps(func)
     async def wrapped(update, context, *args, **kwargs):
         if not is_vip(update.effective_user.id)[0]:
             await update.message.reply_text("🚫 VIP Necessário.")
@@ -124,44 +1084,180 @@ def restricted(func):
         return await func(update, context, *args, **kwargs)
     return wrapped
 
-async def routine_checks(context):
-    now = get_now()
-    now_str = now.strftime("%Y-%m-%d %H:%M")
-    
-    # 1. Agenda
-    to_remove = []
-    if "reminders" in db and db["reminders"]:
-        for i, rem in enumerate(db["reminders"]):
-            if rem["time"] == now_str:
-                try: await context.bot.send_message(chat_id=ADMIN_ID, text=f"⏰ **AGENDA ({rem['time']})**\n\n📌 {rem['text']}", parse_mode="Markdown")
-                except: pass
-                to_remove.append(i)
-        if to_remove:
-            for index in sorted(to_remove, reverse=True): del db["reminders"][index]
-            save_db(db)
-    
-    # 2. IPTV (09:00)
-    if now.hour == 9 and now.minute == 0: await check_iptv_due(context)
-    # 3. Backup (23:59)
-    if now.hour == 23 and now.minute == 59: await perform_auto_backup(context)
-    # 4. Conquistas
-    if now.minute == 30: await check_achievements(context)
+# --- FILA DE SAÍDA ---
+# Envios em massa passam pela OUTBOX: um worker por chat (ordem preservada) e dois baldes de fichas,
+# o do chat (~1 msg/s em privado, 20/min em grupo) e o global do bot (~30/s). Um 429 (RetryAfter)
+# pausa o balde do chat pelo tempo pedido e a mensagem volta para a frente da fila.
+OUT_RATE = float(os.getenv("OUT_RATE", "25"))
+OUT_CHAT_RATE = float(os.getenv("OUT_CHAT_RATE", "1"))
+OUT_GROUP_RATE = float(os.getenv("OUT_GROUP_RATE", str(20 / 60)))
+OUT_RETRIES = int(os.getenv("OUT_RETRIES", "5"))
 
-async def check_iptv_due(context):
-    now = get_now(); amanha = now + timedelta(days=1); clientes = []
-    for c in db["iptv_clients"]:
+class TokenBucket:
+    """`rate` fichas/s, acumulando até `burst`. reserve() já desconta a ficha e diz quanto esperar."""
+    def __init__(self, rate, burst=None):
+        self.rate = rate; self.burst = burst or max(1.0, rate); self.tokens = self.burst; self.t = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic(); self.tokens = min(self.burst, self.tokens + (now - self.t) * self.rate); self.t = now
+
+    def reserve(self):
+        self.refill(); self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, secs): self.refill(); self.tokens = min(self.tokens, 1 - secs * self.rate)  # a próxima ficha só daqui a `secs`
+
+class Outbox:
+    def __init__(self, bot, rate=None, chat_rate=None, group_rate=None, retries=None):
+        self.bot = bot; self.glob = TokenBucket(rate or OUT_RATE); self.chat_rate = chat_rate or OUT_CHAT_RATE
+        self.group_rate = group_rate or OUT_GROUP_RATE; self.retries = OUT_RETRIES if retries is None else retries
+        self.buckets = {}; self.queues = {}; self.workers = {}; self.stats = Counter()
+
+    def send(self, chat_id, stats=None, **kw):
+        """Enfileira um send_message; devolve um Future com a Message (ou a exceção final)."""
+        fut = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(chat_id, collections.deque()).append((fut, kw, stats))
+        if chat_id not in self.workers: self.workers[chat_id] = asyncio.create_task(self.worker(chat_id))
+        return fut
+
+    def pending(self): return sum(len(q) for q in self.queues.values())
+
+    def rate(self, chat_id): return self.group_rate if chat_id < 0 else self.chat_rate  # id negativo = grupo
+
+    async def worker(self, chat_id):
+        q = self.queues[chat_id]
+        if chat_id not in self.buckets: self.buckets[chat_id] = TokenBucket(self.rate(chat_id))
         try:
-            if int(c["day"]) == amanha.day: clientes.append(c)
-        except: pass
+            while q:
+                fut, kw, stats = q.popleft()
+                try: res = await self.deliver(chat_id, kw, stats)
+                except Exception as e:
+                    if not fut.done(): fut.set_exception(e)
+                else:
+                    if not fut.done(): fut.set_result(res)
+        finally:
+            del self.workers[chat_id]
+            if not q: del self.queues[chat_id]
+
+    async def deliver(self, chat_id, kw, stats=None):
+        """Até `retries` novas tentativas: 429 espera o retry_after pedido, erro de rede recua exponencialmente."""
+        bucket = self.buckets[chat_id]; stats = Counter() if stats is None else stats
+        for attempt in range(self.retries + 1):
+            for b in (bucket, self.glob):
+                wait = b.reserve()
+                if wait > 0: await asyncio.sleep(wait)
+            t0 = time.perf_counter()
+            try:
+                msg = await self.bot.send_message(chat_id=chat_id, **kw)
+                observe("telegram", "send", time.perf_counter() - t0); self.stats["sent"] += 1; return msg
+            except RetryAfter as e:
+                wait = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                bucket.pause(float(wait)); kind = "429"; err = e
+            except BadRequest:  # mensagem inválida: repetir não adianta
+                observe("telegram", "send", time.perf_counter() - t0, True); self.stats["failed"] += 1; raise
+            except NetworkError as e: kind = "retry"; err = e
+            observe("telegram", "send", time.perf_counter() - t0, True); self.stats[kind] += 1; stats[kind] += 1
+            if kind == "retry": await asyncio.sleep(min(30.0, 0.5 * 2 ** attempt) * random.uniform(1, 1.25))
+        self.stats["failed"] += 1; raise err
+
+OUTBOX = None
+
+def outbox(bot):
+    global OUTBOX
+    if OUTBOX is None or OUTBOX.bot is not bot: OUTBOX = Outbox(bot)
+    return OUTBOX
+
+async def check_iptv_due(context):
+    amanha = (get_now() + timedelta(days=1)).date(); clientes = IPTV.due_on(amanha)
     if clientes and ADMIN_ID:
-        kb = [[InlineKeyboardButton(f"📲 {c['name']}", callback_data=f"iptv_manage_{c['id']}")] for c in clientes]
+        kb = [[InlineKeyboardButton(f"📲 {c['name']}", callback_data=f"iptv_manage_{c['id']}")] for c in clientes] + [[InlineKeyboardButton("📤 Cobrar todos", callback_data="iptv_bulk")]]
         await context.bot.send_message(chat_id=ADMIN_ID, text=f"📺 **ALERTA IPTV:** {len(clientes)} vencendo amanhã!", reply_markup=InlineKeyboardMarkup(kb))
 
+# Backup = snapshot completo gzip (base) + deltas diários com só os registros do dia, listados no
+# manifest.json com sha256. Nova base a cada BACKUP_FULL_DAYS dias ou quando os deltas passam de
+# metade do tamanho da base; restore_backup() remonta o banco a partir da cadeia.
+def read_manifest():
+    try:
+        with open(MANIFEST_FILE) as f: return json.load(f)
+    except (OSError, ValueError): return {"base": None, "deltas": []}
+
+def write_gz_json(data, path):
+    with gzip.open(path, "wt", encoding="utf-8") as f: json.dump(data, f, default=tx_json)
+    return sha256_file(path)
+
+@timed("backup")
+async def run_backup(full=False):
+    """Fecha o delta do dia (ou gera nova base). Retorna (arquivos para enviar, legenda)."""
+    man = read_manifest(); now = get_now(); stamp = now.strftime("%Y%m%d-%H%M%S"); base = man.get("base")
+    if base and not full:
+        chain = sum(os.path.getsize(os.path.join(BACKUP_DIR, d["file"])) for d in man["deltas"] if os.path.exists(os.path.join(BACKUP_DIR, d["file"])))
+        age = (now - datetime.strptime(base["date"], "%Y%m%d-%H%M%S")).days
+        full = age >= BACKUP_FULL_DAYS or chain > os.path.getsize(os.path.join(BACKUP_DIR, base["file"])) / 2
+    full = full or not base
+    cut = f"{stamp}-{len(man['deltas']) + 1:03d}"
+    if full and TENANT_MODE: delta, snap = await asyncio.wrap_future(WRITER.cut(cut, snap=read_partitions))  # lido do disco pelo writer
+    else:
+        snap = copy_db() if full else None  # copiado junto com o corte: mesmo ponto da fila de escrita
+        delta = await asyncio.wrap_future(WRITER.cut(cut))
+    if full:
+        name = f"snap_{stamp}.json.gz"; sha = await asyncio.to_thread(write_gz_json, snap, os.path.join(BACKUP_DIR, name))
+        old = ([base["file"]] if base else []) + [d["file"] for d in man["deltas"]] + ([delta["file"]] if delta else [])
+        for f in old:
+            if f != name and os.path.exists(os.path.join(BACKUP_DIR, f)): os.remove(os.path.join(BACKUP_DIR, f))
+        man = {"base": {"file": name, "sha256": sha, "date": stamp}, "deltas": []}; files = [name]; caption = "🔄 Backup completo"
+    elif delta: man["deltas"].append(delta); files = [delta["file"]]; caption = f"🔄 Backup diário: {delta['records']} alterações"
+    else: files = []; caption = "🔄 Backup diário: sem alterações"
+    tmp = MANIFEST_FILE + ".tmp"
+    with open(tmp, "w") as f: json.dump(man, f, indent=2)
+    os.replace(tmp, MANIFEST_FILE)
+    return files + ["manifest.json"], caption
+
+async def send_backup(bot, chat_id, full=False):
+    files, caption = await run_backup(full)
+    for i, name in enumerate(files):
+        with open(os.path.join(BACKUP_DIR, name), "rb") as f: await bot.send_document(chat_id=chat_id, document=f, filename=name, caption=caption if i == 0 else None)
+
+def restore_backup(folder=BACKUP_DIR):
+    """python main.py --restore [pasta]: base + deltas do manifest (conferindo sha256) -> DB_FILE."""
+    with open(os.path.join(folder, "manifest.json")) as f: man = json.load(f)
+    def checked(entry):
+        path = os.path.join(folder, entry["file"])
+        if sha256_file(path) != entry["sha256"]: raise SystemExit(f"❌ Checksum não confere: {entry['file']}")
+        return path
+    with gzip.open(checked(man["base"]), "rt", encoding="utf-8") as f: data = json.load(f)
+    parts = data.pop("_tenants", None); n = 0
+    if parts is None: data = fix_db(data)
+    def part(u):
+        if u not in parts: parts[u] = {k: v for k, v in default_db().items() if k not in GLOBAL_KEYS}
+        return parts[u]
+    for d in man["deltas"]:
+        with gzip.open(checked(d), "rt", encoding="utf-8") as f:
+            for line in f:
+                rec = json.loads(line); u = rec.get("u") if parts is not None else None
+                apply_record(data if u is None else part(u), rec); n += 1
+    WRITER.close()
+    if parts is None:
+        if os.path.exists(DB_FILE): shutil.copy(DB_FILE, DB_FILE + ".pre-restore")
+        data.pop("_seq", None); write_snapshot(DB_FILE, data); bases = [(DB_FILE, JOURNAL_FILE, SQLITE_FILE)]
+        total = len(data["transactions"])
+    else:
+        os.makedirs(TENANT_DIR, exist_ok=True); write_snapshot(GLOBAL_BASE + ".json", data); bases = [(GLOBAL_BASE + ".json", GLOBAL_BASE + ".journal", GLOBAL_BASE + ".sqlite3")]
+        for u, p in parts.items():
+            p.pop("_seq", None); write_snapshot(tenant_base(u) + ".json", p); b = tenant_base(u)
+            bases.append((b + ".json", b + ".journal", b + ".sqlite3"))
+        total = sum(len(p["transactions"]) for p in parts.values())
+    for _, journal, sqlite in bases:
+        for p in (journal, journal + ".1", sqlite, sqlite + "-wal", sqlite + "-shm"):
+            if os.path.exists(p): os.remove(p)  # o SQLite é recriado a partir do JSON na próxima partida
+    pending = os.path.join(BACKUP_DIR, "pending.jsonl")
+    if os.path.exists(pending): os.remove(pending)
+    print(f"✅ Restaurado: base {man['base']['file']} + {len(man['deltas'])} deltas ({n} registros), {total} transações" + (f" em {len(parts)} partições" if parts is not None else ""))
+
 async def perform_auto_backup(context):
-    if ADMIN_ID and os.path.exists(DB_FILE):
-        try:
-            with open(DB_FILE, "rb") as f: await context.bot.send_document(chat_id=ADMIN_ID, document=f, caption="🔄 Backup Diário")
-        except: pass
+    try:
+        if ADMIN_ID: await send_backup(context.bot, ADMIN_ID)
+        else: await run_backup()
+    except Exception as e: logger.error(f"Backup: {e}")
 
 async def check_achievements(context):
     if not ADMIN_ID: return
@@ -172,7 +1268,90 @@ async def check_achievements(context):
     if saldo > 1000 and "rich_1k" not in db["achievements"]:
         db["achievements"].append("rich_1k"); new_badge = "💸 **Primeiro K**"
     if new_badge:
-        save_db(db); await context.bot.send_message(chat_id=ADMIN_ID, text=f"🏆 **NOVA CONQUISTA!**\n\n{new_badge}", parse_mode="Markdown")
+        save_db(db, "achievements"); await context.bot.send_message(chat_id=ADMIN_ID, text=f"🏆 **NOVA CONQUISTA!**\n\n{new_badge}", parse_mode="Markdown")
+
+# ---- Agendador: min-heap no próprio event loop ----
+# Itens (quando, seq, tipo, dado) num heap; o laço dorme até o primeiro vencer (ou até um push
+# acordá-lo) e routine_checks só retira o que venceu: O(log n) por item, sem varrer a agenda.
+# O que venceu com o bot fora do ar dispara na volta; tarefas diárias lembram a última execução
+# em db["config"]["last_runs"].
+DAILY_JOBS = [("iptv", (9, 0), check_iptv_due), ("backup", (23, 59), perform_auto_backup)]
+SCHED_HEAP = []; SCHED_SEQ = itertools.count(); SCHED_WAKE = asyncio.Event(); SCHED_TASKS = set()
+
+def sched_push(when, kind, data=None):
+    heapq.heappush(SCHED_HEAP, (when, next(SCHED_SEQ), kind, data)); SCHED_WAKE.set()
+
+SCHED_WAKES = set()  # (uid, quando) já no heap: evita acordar a mesma partição duas vezes
+
+def sched_wake(uid, when):
+    if (uid, when) not in SCHED_WAKES: SCHED_WAKES.add((uid, when)); sched_push(when, "wake", uid)
+
+def sched_reminder(rem):
+    when = rem_when(rem)
+    if when is None: logger.warning(f"Lembrete com horário inválido: {rem}")
+    elif TENANT_MODE: sched_wake(tenant_id(), when)
+    else: sched_push(when, "reminder", rem)
+
+def next_half_hour(now):
+    when = now.replace(minute=30, second=0, microsecond=0)
+    return when if when > now else when + timedelta(hours=1)
+
+def sched_load():
+    SCHED_HEAP.clear(); SCHED_WAKES.clear(); now = get_now(); last = db["config"].setdefault("last_runs", {}); seeded = False
+    if TENANT_MODE:
+        for uid, when in db["config"].get("reminder_due", {}).items(): sched_wake(uid, datetime.strptime(when, "%Y-%m-%d %H:%M"))
+    else:
+        for rem in db["reminders"]: sched_reminder(rem)
+    for name, (h, m), _ in DAILY_JOBS:
+        occ = now.replace(hour=h, minute=m, second=0, microsecond=0)
+        if occ > now: occ -= timedelta(days=1)  # ocorrência mais recente (hoje ou ontem)
+        if name not in last: last[name] = occ.strftime("%Y-%m-%d"); seeded = True  # job novo/upgrade: não há o que recuperar
+        if last[name] >= occ.strftime("%Y-%m-%d"): occ += timedelta(days=1)  # já rodou: espera a próxima
+        sched_push(max(occ, now), "daily", (name, occ))  # perdida (ex.: reinício passando da meia-noite): roda já
+    if seeded: save_db(db, "config")
+    sched_push(next_half_hour(now), "hourly")
+
+async def send_reminder(context, rem, when):
+    if rem not in db["reminders"]: return  # apagado pelo "Limpar" da agenda
+    late = " (atrasado)" if get_now() - when > timedelta(minutes=2) else ""
+    try: await context.bot.send_message(chat_id=rem.get("chat_id") or ADMIN_ID, text=f"⏰ **AGENDA ({rem['time']}){late}**\n\n📌 {rem['text']}", parse_mode="Markdown")
+    except: pass
+    if rem in db["reminders"]: db["reminders"].remove(rem); save_db(db, "reminders")
+
+async def run_job(context, when, kind, data):
+    if kind == "reminder": await send_reminder(context, data, when)
+    elif kind == "wake":  # modo TENANTS: carrega a partição, dispara o que venceu e agenda o próximo
+        SCHED_WAKES.discard((data, when))
+        async with TENANTS.use(data):
+            now = get_now()
+            for rem in [r for r in db["reminders"] if (rem_when(r) or now + timedelta(days=1)) <= now]: await send_reminder(context, rem, rem_when(rem))
+            nxt = [w for w in map(rem_when, db["reminders"]) if w and w > now]
+            if nxt: sched_wake(data, min(nxt))
+    elif kind == "daily":
+        name, occ = data; fn = next(j[2] for j in DAILY_JOBS if j[0] == name); nxt = occ + timedelta(days=1)
+        db["config"].setdefault("last_runs", {})[name] = occ.strftime("%Y-%m-%d"); save_db(db, "config")  # data da ocorrência coberta
+        sched_push(nxt, "daily", (name, nxt))
+        await fn(context)
+    elif kind == "hourly":
+        sched_push(next_half_hour(get_now()), "hourly")
+        await check_achievements(context)
+
+async def routine_checks(context):
+    """Dispara tudo que já venceu. Retorna quantos segundos faltam para o próximo item."""
+    now = get_now()
+    while SCHED_HEAP and SCHED_HEAP[0][0] <= now:
+        when, _, kind, data = heapq.heappop(SCHED_HEAP)
+        task = asyncio.create_task(run_job(context, when, kind, data)); SCHED_TASKS.add(task); task.add_done_callback(SCHED_TASKS.discard)
+    return (SCHED_HEAP[0][0] - now).total_seconds() if SCHED_HEAP else 3600
+
+async def scheduler_loop(context):
+    sched_load()
+    while True:
+        SCHED_WAKE.clear()
+        try: delay = await routine_checks(context)
+        except Exception as e: logger.error(f"Agendador: {e}"); delay = 60
+        try: await asyncio.wait_for(SCHED_WAKE.wait(), timeout=min(delay, 3600))
+        except asyncio.TimeoutError: pass
 
 # ================= 6. INTERFACE =================
 async def start(update, context):
@@ -212,11 +1391,14 @@ async def menu_goals(update, context):
     txt = f"🎯 **METAS**\nSaldo: R$ {saldo:.2f}\n\n"
     if not db["goals"]: txt += "_Vazio_"
     else:
+        p = projection()
         for g in db["goals"]:
             prog = (saldo / g['val']) * 100 if g['val'] > 0 else 0
             if prog > 100: prog = 100
             bar = "█" * int(prog/10) + "░" * (10 - int(prog/10))
-            txt += f"📌 **{g['name']}**\nR$ {g['val']:.2f}\n`[{bar}] {prog:.1f}%`\n\n"
+            eta = p.reach(saldo, g['val'])
+            quando = "✅ Atingida" if prog >= 100 else f"⏳ Previsão: {eta.strftime('%d/%m/%Y')}" if eta else f"⏳ Além de {FORECAST_MONTHS} meses no ritmo atual"
+            txt += f"📌 **{g['name']}**\nR$ {g['val']:.2f}\n`[{bar}] {prog:.1f}%`\n{quando}\n\n"
     kb = [[InlineKeyboardButton("➕ Nova", callback_data="goal_add"), InlineKeyboardButton("🗑️ Limpar", callback_data="goal_del")], [InlineKeyboardButton("🔙", callback_data="back")]]
     await update.callback_query.edit_message_text(txt, reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
 
@@ -226,9 +1408,9 @@ async def goal_save_val(update, context):
     try:
         v = float(update.message.text.replace(',', '.'))
         db["goals"].append({"name": context.user_data["gn"], "val": v})
-        save_db(db); await update.message.reply_text("✅ Meta Salva!"); return await start(update, context)
+        save_db(db, "goals"); await update.message.reply_text("✅ Meta Salva!"); return await start(update, context)
     except: await update.message.reply_text("Erro valor."); return GOAL_VAL
-async def goal_del(update, context): db["goals"] = []; save_db(db); await menu_goals(update, context)
+async def goal_del(update, context): db["goals"] = []; save_db(db, "goals"); await menu_goals(update, context)
 
 # ================= CONQUISTAS =================
 async def menu_badges(update, context):
@@ -252,12 +1434,86 @@ async def menu_reports(update, context):
     ]
     await update.callback_query.edit_message_text("📊 **Relatórios:**", reply_markup=InlineKeyboardMarkup(kb))
 
+# Consultas por mês ("MM/AAAA") direto do ROLLUP
+def month_rollup(kind, m): return ROLLUP.get(m, {}).get(kind)
+
+def month_total(kind, m):
+    r = month_rollup(kind, m); return r["total"][0] if r else 0
+
+def month_group(kind, m, field):
+    r = month_rollup(kind, m); return {k: v[0] for k, v in r["desc" if field == "description" else "cat"].items()} if r else {}
+
+def month_days(kind, m):
+    r = month_rollup(kind, m); return set(r["day"]) if r else set()
+
+# ---- Projeção de saldo ----
+# Fluxo diário em arrays NumPy de amanhã até FORECAST_MONTHS meses à frente: receita IPTV (IPTV.day_sum,
+# 31 buckets já somados), assinaturas por dia, e a mediana mensal dos últimos FORECAST_BASE_MONTHS meses
+# fechados para gastos (menos as assinaturas, que já aparecem no histórico) e outras receitas, espalhada
+# pelos dias. Só o fluxo acumulado é guardado: o saldo atual é somado na consulta, então lançamentos do
+# mês corrente não invalidam nada; a chave muda com o dia, clientes, assinaturas ou meses da base.
+FORECAST_MONTHS = 12
+FORECAST_BASE_MONTHS = int(os.getenv("FORECAST_BASE_MONTHS", "6"))
+FORECASTS = OrderedDict()  # tenant -> (chave, Projection)
+
+class Projection:
+    __slots__ = ("start", "cum", "base")
+
+    def __init__(self, start, cum, base): self.start, self.cum, self.base = start, cum, base
+
+    def day(self, i): return self.start + timedelta(days=i)
+
+    def at(self, saldo, d):
+        """Saldo projetado no fim do dia `d` (limitado ao horizonte)."""
+        i = min(max((d - self.start).days, 0), len(self.cum) - 1); return saldo + float(self.cum[i])
+
+    def low(self, saldo, days=None):
+        i = int(self.cum[:days].argmin()); return self.day(i), saldo + float(self.cum[i])
+
+    def reach(self, saldo, target):
+        """Primeiro dia em que o saldo projetado chega a `target`: hoje se já chegou, None se não chega no horizonte."""
+        if saldo >= target: return self.start - timedelta(days=1)
+        hit = self.cum >= target - saldo
+        return self.day(int(hit.argmax())) if hit.any() else None
+
+def base_months(today):
+    y, m = today.year, today.month; out = []
+    for _ in range(FORECAST_BASE_MONTHS): y, m = (y - 1, 12) if m == 1 else (y, m - 1); out.append(f"{m:02d}/{y}")
+    return out
+
+@timed("render", "forecast")
+def build_projection(today, months, subs):
+    import numpy as np
+    n = (today + relativedelta(months=FORECAST_MONTHS) - today).days
+    days = np.datetime64(today, "D") + np.arange(1, n + 1); mon = days.astype("datetime64[M]")
+    dom = (days - mon.astype("datetime64[D]")).astype(int) + 1
+    last = ((mon + 1).astype("datetime64[D]") - mon.astype("datetime64[D]")).astype(int)
+    def hits(by_day):  # vencimento no dia 31 cai no último dia de meses curtos
+        tail = np.cumsum(by_day[::-1])[::-1]; return np.where(dom == last, tail[dom], by_day[dom])
+    sd = []; sv = []
+    for x in subs:
+        try: sd.append(min(max(int(x["day"]), 1), 31)); sv.append(float(x["val"]))
+        except (KeyError, TypeError, ValueError): pass
+    sub_day = np.bincount(np.asarray(sd, dtype=int), weights=np.asarray(sv, dtype=float), minlength=32)
+    spent = [month_total("gasto", m) for m in months if m in ROLLUP]
+    other = [month_total("ganho", m) - month_group("ganho", m, "category").get("Vendas/IPTV", 0) for m in months if m in ROLLUP]
+    spend = max(float(np.median(spent)) - float(sub_day.sum()), 0.0) if spent else 0.0; other = float(np.median(other)) if other else 0.0
+    flow = hits(np.asarray(IPTV.day_sum, dtype=float)) - hits(sub_day) + (other - spend) / last
+    base = {"iptv": IPTV.total, "other": other, "subs": float(sub_day.sum()), "spend": spend, "months": len(spent)}
+    return Projection(today + timedelta(days=1), np.cumsum(flow), base)
+
+def projection():
+    today = get_now().date(); months = base_months(today); subs = db.get("subscriptions", [])
+    key = (today, tuple(ROLLUP_VER.get(m, 0) for m in months), IPTV.ver, tuple((x.get("val"), x.get("day")) for x in subs))
+    tid = tenant_id(); hit = FORECASTS.get(tid)
+    if hit and hit[0] == key: FORECASTS.move_to_end(tid); return hit[1]
+    p = build_projection(today, months, subs); FORECASTS[tid] = (key, p)
+    while len(FORECASTS) > TENANT_MAX: FORECASTS.popitem(last=False)
+    return p
+
 async def rep_rank(update, context):
     await update.callback_query.answer("Calculando...")
-    m = get_now().strftime("%m/%Y"); rank = {}
-    for t in db["transactions"]:
-        if t['type'] == 'gasto' and m in t['date']:
-            k = t.get('description', t['category']); rank[k] = rank.get(k, 0) + t['value']
+    m = get_now().strftime("%m/%Y"); rank = month_group("gasto", m, "description")
     sorted_rank = sorted(rank.items(), key=lambda item: item[1], reverse=True)[:5]
     txt = f"🏆 **VILÕES ({m})**\n\n"; medals = ["🥇", "🥈", "🥉", "4️⃣", "5️⃣"]
     for i, (nome, val) in enumerate(sorted_rank): txt += f"{medals[i]} **{nome}**: R$ {val:.2f}\n"
@@ -265,43 +1521,223 @@ async def rep_rank(update, context):
 
 async def rep_comp(update, context):
     now = get_now(); m_atual = now.strftime("%m/%Y"); m_ant = (now - relativedelta(months=1)).strftime("%m/%Y")
-    g_atual = sum(t['value'] for t in db["transactions"] if t['type']=='gasto' and m_atual in t['date'])
-    g_ant = sum(t['value'] for t in db["transactions"] if t['type']=='gasto' and m_ant in t['date'])
+    g_atual = month_total("gasto", m_atual)
+    g_ant = month_total("gasto", m_ant)
     diff = g_atual - g_ant; icon = "🔴" if diff > 0 else "🟢"
     txt = f"📉 **COMPARATIVO**\n{m_ant}: R$ {g_ant:.2f}\n{m_atual}: R$ {g_atual:.2f}\nDiff: {icon} R$ {abs(diff):.2f}"
     await update.callback_query.edit_message_text(txt, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙", callback_data="menu_reports")]]), parse_mode="Markdown")
 
 async def rep_forecast(update, context):
-    now = get_now(); d7 = now + timedelta(days=7); d30 = now + timedelta(days=30); val7 = 0; val30 = 0
-    for c in db["iptv_clients"]:
-        try:
-            dia_venc = int(c['day']); val = c.get('value', 0); prox_venc = datetime(now.year, now.month, dia_venc)
-            if prox_venc < now: prox_venc += relativedelta(months=1)
-            if prox_venc <= d7: val7 += val
-            if prox_venc <= d30: val30 += val
-        except: pass
-    txt = f"🔮 **VIDENTE IPTV**\n\n7 Dias: R$ {val7:.2f}\n30 Dias: R$ {val30:.2f}"
+    today = get_now().date(); val7 = IPTV.forecast(today, 7); val30 = IPTV.forecast(today, 30)
+    saldo, _ = calc_stats(); p = projection(); b = p.base
+    txt = f"🔮 **VIDENTE IPTV**\n\n7 Dias: R$ {val7:.2f}\n30 Dias: R$ {val30:.2f}\n\n📈 **Saldo projetado** (hoje R$ {saldo:.2f})\n"
+    for k in (3, 6, 12):
+        d = today + relativedelta(months=k); txt += f"{k} meses ({d.strftime('%d/%m/%Y')}): R$ {p.at(saldo, d):.2f}\n"
+    d, v = p.low(saldo)
+    if v < 0: txt += f"⚠️ Fica negativo: R$ {v:.2f} em {d.strftime('%d/%m/%Y')}\n"
+    txt += (f"\n_Por mês: IPTV +{b['iptv']:.2f} | outras receitas +{b['other']:.2f} | assinaturas -{b['subs']:.2f} | "
+            f"demais gastos -{b['spend']:.2f} (mediana de {b['months']} meses)_")
     await update.callback_query.edit_message_text(txt, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙", callback_data="menu_reports")]]), parse_mode="Markdown")
 
+# ---- Exportação: gerada numa thread, em arquivo temporário por pedido, lendo um gerador ----
+def iter_transactions(trans, start=None, end=None, kind=None, category=None):
+    """Filtra sem copiar registros. start/end em ts (end exclusivo), kind = código de TX_TYPES."""
+    for t in trans:
+        if kind is not None and t.kind != kind: continue
+        if category and t.category != category: continue
+        if start is not None and (t.ts is None or t.ts < start): continue
+        if end is not None and (t.ts is None or t.ts >= end): continue
+        yield t
+
+@timed("export")
+def write_csv(rows, path):
+    n = 0
+    with open(path, "w", newline='', encoding='utf-8-sig') as f:
+        w = csv.writer(f, delimiter=';'); w.writerow(["Data", "Tipo", "Valor", "Categoria", "Descricao"])
+        for t in rows: w.writerow([t.date, t.type, str(t.value).replace('.',','), t.category, t.description or '']); n += 1
+    return n
+
+# O CSV sai em memória constante. O PDF não: o canvas do reportlab guarda toda página pronta até o
+# save(), então só as PDF_MAX_ROWS primeiras linhas são desenhadas; o resto entra apenas nos totais.
+PDF_MAX_ROWS = int(os.getenv("PDF_MAX_ROWS", "5000"))
+
+@timed("export")
+def write_pdf(rows, path):
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+    c = canvas.Canvas(path, pagesize=letter); width, height = letter; page = 0; y = 0; n = 0; tot = {}
+    for t in rows:
+        if n >= PDF_MAX_ROWS: tot[t.type] = tot.get(t.type, 0) + t.value; n += 1; continue
+        if y < 60:
+            if page: c.showPage()
+            page += 1; c.setFont("Helvetica-Bold", 14); c.drawString(50, height - 42, "EXTRATO")
+            c.setFont("Helvetica", 8); c.drawRightString(width - 50, height - 42, f"Página {page}"); y = height - 70
+        c.drawString(50, y, f"{t.date} | {t.type} | R$ {t.value:.2f} | {t.category} | {(t.description or '')[:60]}"); y -= 14; n += 1
+        tot[t.type] = tot.get(t.type, 0) + t.value
+    if not page: c.setFont("Helvetica-Bold", 14); c.drawString(50, height - 42, "EXTRATO"); y = height - 70
+    if y < 74 + 14 * len(tot): c.showPage(); y = height - 70
+    if n > PDF_MAX_ROWS: c.setFont("Helvetica-Oblique", 8); c.drawString(50, y, f"... mais {n - PDF_MAX_ROWS} lançamentos (só nos totais; use /exportar csv para a lista completa)"); y -= 14
+    c.setFont("Helvetica-Bold", 9)
+    for k, v in tot.items(): c.drawString(50, y, f"Total {k}: R$ {v:.2f}"); y -= 14
+    c.save(); return n
+
+async def send_export(message, fmt, newest_first=False, **flt):
+    trans = list(db["transactions"])  # só os ponteiros; a thread não vê handlers mexendo na lista
+    fd, path = tempfile.mkstemp(prefix="relatorio_", suffix=f".{fmt}"); os.close(fd)
+    try:
+        rows = iter_transactions(reversed(trans) if newest_first else trans, **flt)
+        n = await asyncio.to_thread(write_pdf if fmt == "pdf" else write_csv, rows, path)
+        with open(path, "rb") as f: await message.reply_document(f, filename=f"relatorio.{fmt}", caption=f"{n} lançamentos")
+    finally: os.remove(path)
+
 async def rep_csv(update, context):
     await update.callback_query.answer("Gerando CSV...")
-    with open("relatorio.csv", "w", newline='', encoding='utf-8-sig') as f:
-        import csv; w = csv.writer(f, delimiter=';'); w.writerow(["Data", "Tipo", "Valor", "Categoria", "Descricao"])
-        for t in db["transactions"]: w.writerow([t['date'], t['type'], str(t['value']).replace('.',','), t['category'], t.get('description', '')])
-    with open("relatorio.csv", "rb") as f: await update.callback_query.message.reply_document(f)
+    await send_export(update.callback_query.message, "csv")
+
+def parse_filters(args):
+    """Período (MM/AAAA ou dd/mm/aaaa-dd/mm/aaaa) e tipo (ganho|gasto). Retorna (filtros, palavras que sobraram)."""
+    flt = {}; rest = []
+    for a in args:
+        rng = re.fullmatch(r"(\d{2}/\d{2}/\d{4})-(\d{2}/\d{2}/\d{4})", a); mon = re.fullmatch(r"(\d{2})/(\d{4})", a)
+        if rng and parse_ts(rng.group(1)) is not None and parse_ts(rng.group(2)) is not None:
+            flt["start"] = parse_ts(rng.group(1)); flt["end"] = parse_ts(rng.group(2)) + 1440
+        elif mon and 1 <= int(mon.group(1)) <= 12:
+            y, m = int(mon.group(2)), int(mon.group(1))
+            flt["start"] = to_ts(date(y, m, 1)); flt["end"] = to_ts(date(y + 1, 1, 1) if m == 12 else date(y, m + 1, 1))
+        elif a.lower() in ("ganho", "gasto"): flt["kind"] = TX_TYPES.index(a.lower())
+        else: rest.append(a)
+    return flt, rest
+
+def known_category(name):
+    return {c.lower(): c for k in db["categories"] for c in db["categories"][k]}.get(name.lower())
+
+@restricted
+async def export_cmd(update, context):
+    """/exportar [csv|pdf] [MM/AAAA | dd/mm/aaaa-dd/mm/aaaa] [ganho|gasto] [categoria]"""
+    args = list(context.args); fmt = args.pop(0).lower() if args and args[0].lower() in ("csv", "pdf") else "csv"
+    flt, cat = parse_filters(args)
+    if cat: name = " ".join(cat); flt["category"] = known_category(name) or name
+    await update.message.reply_text("⏳ Gerando...")
+    await send_export(update.message, fmt, newest_first=(fmt == "pdf"), **flt)
+
+# ---- Extrato paginado (TXINDEX) ----
+# user_data["st"] = {"q": filtros da busca, "at": (cursor, older) da página na tela}. Os botões levam
+# só o cursor ("ext_o_<ts>_<seq>" = mais antigos, "ext_n_..." = mais novos); a busca fica no user_data.
+def statement_query(args):
+    flt, rest = parse_filters(args); cat = known_category(" ".join(rest)) if rest else None
+    if cat: flt["category"] = cat
+    elif rest: flt["words"] = [w for a in rest for w in WORD_RE.findall(a.lower())]
+    return flt
+
+def statement_view(st):
+    cursor, older = st.get("at") or (None, True)
+    items, more_old, more_new = TXINDEX.page(tuple(cursor) if cursor else None, older, **st.get("q", {}))
+    q = st.get("q", {}); desc = []
+    if q.get("words"): desc.append("\"" + " ".join(q["words"]) + "\"")
+    if q.get("category"): desc.append(q["category"])
+    if q.get("kind") is not None: desc.append(TX_TYPES[q["kind"]])
+    if q.get("start") is not None: desc.append(f"{ts_date(q['start']):%d/%m/%Y}-{ts_date(q['end'] - 1):%d/%m/%Y}")
+    txt = "📝 **EXTRATO**" + (f" · {' · '.join(desc)}" if desc else "") + "\n"
+    txt += "_Toque para ver ou apagar. Busca: /extrato uber 03/2026 gasto_" if items else "_Nada encontrado._"
+    kb = [[InlineKeyboardButton(f"{t.date[:5]} {'🔴' if t.type == 'gasto' else '🟢'} R$ {t.value:.2f} · {(t.description or t.category)[:24]}", callback_data=f"txv_{t.id}")] for t in items]
+    nav = []
+    if items and more_new: k = TXINDEX.key(items[0]); nav.append(InlineKeyboardButton("⬅️ Mais novos", callback_data=f"ext_n_{k[0]}_{k[1]}"))
+    if items and more_old: k = TXINDEX.key(items[-1]); nav.append(InlineKeyboardButton("Mais antigos ➡️", callback_data=f"ext_o_{k[0]}_{k[1]}"))
+    if nav: kb.append(nav)
+    kb.append(([InlineKeyboardButton("❌ Limpar busca", callback_data="ext_clr")] if q else []) + [InlineKeyboardButton("🔙", callback_data="menu_reports")])
+    return txt, InlineKeyboardMarkup(kb)
+
+async def rep_list(update, context):
+    context.user_data["st"] = {"q": {}, "at": None}; txt, kb = statement_view(context.user_data["st"])
+    await update.callback_query.edit_message_text(txt, reply_markup=kb, parse_mode="Markdown")
+
+async def statement_nav(update, context, answered=False):
+    st = context.user_data.setdefault("st", {"q": {}, "at": None}); data = update.callback_query.data
+    if data == "ext_clr": st.update(q={}, at=None)
+    elif data.startswith(("ext_o_", "ext_n_")):
+        _, d, ts, seq = data.split("_"); st["at"] = ((int(ts), int(seq)), d == "o")
+    txt, kb = statement_view(st)
+    if not answered: await update.callback_query.answer()  # o tx_view já respondeu ("Não existe mais.")
+    await update.callback_query.edit_message_text(txt, reply_markup=kb, parse_mode="Markdown")
+
+@restricted
+async def statement_cmd(update, context):
+    """/extrato [texto | categoria] [MM/AAAA | dd/mm/aaaa-dd/mm/aaaa] [ganho|gasto]"""
+    st = context.user_data["st"] = {"q": statement_query(context.args), "at": None}; txt, kb = statement_view(st)
+    await update.message.reply_text(txt, reply_markup=kb, parse_mode="Markdown")
+
+async def tx_view(update, context):
+    t = TXINDEX.get(update.callback_query.data.replace("txv_", ""))
+    if not t: await update.callback_query.answer("Não existe mais."); return await statement_nav(update, context, answered=True)
+    txt = f"🧾 {t.type.upper()} R$ {t.value:.2f}\n📅 {t.date}\n📂 {t.category}\n📝 {t.description or '-'}\n🆔 {t.id}"  # sem Markdown: descrição é texto livre
+    kb = [[InlineKeyboardButton("🗑️ Apagar", callback_data=f"del_tr_{t.id}"), InlineKeyboardButton("🔙", callback_data="ext_cur")]]
+    await update.callback_query.edit_message_text(txt, reply_markup=InlineKeyboardMarkup(kb))
+
+# ---- Gráficos: renderizados fora do event loop, PNG em cache por (tipo, mês, versão dos dados) ----
+# Usa Figure() direto (sem pyplot), então cada render é independente e não acumula figuras.
+CHART_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chart")
+CHART_CACHE = OrderedDict()  # (tipo, mês, versão) -> {"png": bytes, "file_id": str|None}
+CHART_CACHE_MAX = 32
+CHART_PENDING = {}
+
+def fig_png(fig):
+    buf = io.BytesIO(); fig.savefig(buf, format='png'); return buf.getvalue()
+
+FIG_LOCK = threading.Lock(); FIGURE = None
+
+def load_figure():
+    """Importa o matplotlib só no primeiro gráfico (o estilo escuro é global, aplicado uma vez)."""
+    global FIGURE
+    with FIG_LOCK:
+        if FIGURE is None:
+            import matplotlib
+            matplotlib.use('Agg')
+            import matplotlib.style; matplotlib.style.use('dark_background')
+            from matplotlib.figure import Figure
+            FIGURE = Figure
+    return FIGURE
+
+@timed("render")
+def render_pie(cats):
+    Figure = load_figure(); fig = Figure(figsize=(6, 4)); ax = fig.subplots()
+    ax.pie(cats.values(), autopct='%1.1f%%', startangle=90, colors=COLORS); ax.legend(cats.keys(), loc="best")
+    return fig_png(fig)
+
+@timed("render")
+def render_evo(labels, vals):
+    Figure = load_figure(); fig = Figure(figsize=(6, 4)); ax = fig.subplots()
+    ax.plot(labels, vals, marker='o', color='#00ffcc'); ax.grid(alpha=0.3); ax.set_title("Evolução", color="white")
+    return fig_png(fig)
+
+async def chart(kind, month, ver, render, *args):
+    key = (tenant_id(), kind, month, ver)
+    if key in CHART_CACHE: CHART_CACHE.move_to_end(key); return CHART_CACHE[key]
+    if key not in CHART_PENDING:  # dois toques seguidos esperam o mesmo render
+        CHART_PENDING[key] = asyncio.get_running_loop().run_in_executor(CHART_POOL, render, *args)
+    try: png = await CHART_PENDING[key]
+    finally: CHART_PENDING.pop(key, None)
+    for k in [k for k in CHART_CACHE if k[:3] == key[:3]]: del CHART_CACHE[k]  # versões antigas
+    entry = CHART_CACHE[key] = {"png": png, "file_id": None}
+    while len(CHART_CACHE) > CHART_CACHE_MAX: CHART_CACHE.popitem(last=False)
+    return entry
+
+async def send_chart(message, entry):
+    # Depois do primeiro envio reaproveita o file_id do Telegram em vez de subir o PNG de novo
+    sent = await message.reply_photo(entry["file_id"] or entry["png"])
+    try: entry["file_id"] = sent.photo[-1].file_id
+    except (AttributeError, IndexError, TypeError): pass
 
 async def rep_evo(update, context):
     await update.callback_query.answer("Gerando...")
     d, l = [], []
-    for i in range(5, -1, -1):
-        m = (get_now() - relativedelta(months=i)).strftime("%m/%Y")
-        val = sum(t['value'] for t in db["transactions"] if t['type']=='gasto' and m in t['date'])
-        d.append(val); l.append(m[:2])
-    plt.clf(); plt.figure(figsize=(6, 4)); plt.plot(l, d, marker='o', color='#00ffcc'); plt.grid(alpha=0.3); plt.title("Evolução", color="white")
-    buf = io.BytesIO(); plt.savefig(buf, format='png'); buf.seek(0); plt.close(); await update.callback_query.message.reply_photo(buf)
+    months = [(get_now() - relativedelta(months=i)).strftime("%m/%Y") for i in range(5, -1, -1)]
+    for m in months:
+        d.append(month_total("gasto", m)); l.append(m[:2])
+    entry = await chart("evo", months[-1], tuple(ROLLUP_VER.get(m, 0) for m in months), render_evo, l, d)
+    await send_chart(update.callback_query.message, entry)
 
 async def rep_nospend(update, context):
-    m = get_now().strftime("%m/%Y"); dg = {int(t['date'][:2]) for t in db["transactions"] if t['type']=='gasto' and m in t['date']}
+    m = get_now().strftime("%m/%Y"); dg = month_days("gasto", m)
     txt = f"📅 **Mapa {m}**\n` D S T Q Q S S`\n"; 
     for d in range(1, 32):
         if d > get_now().day: break
@@ -310,9 +1746,9 @@ async def rep_nospend(update, context):
 
 # ================= MÓDULO IPTV =================
 async def menu_iptv(update, context):
-    total = len(db["iptv_clients"]); receita = sum(c.get("value", 0) for c in db["iptv_clients"])
+    total = len(IPTV.by_id); receita = IPTV.total
     msg = f"📺 **GESTOR IPTV**\nClientes: **{total}**\nReceita: **R$ {receita:.2f}**"
-    kb = [[InlineKeyboardButton("➕ Novo", callback_data="iptv_add"), InlineKeyboardButton("📋 Lista", callback_data="iptv_list")], [InlineKeyboardButton("🔙", callback_data="back")]]
+    kb = [[InlineKeyboardButton("➕ Novo", callback_data="iptv_add"), InlineKeyboardButton("📋 Lista", callback_data="iptv_list")], [InlineKeyboardButton("📤 Cobrar todos", callback_data="iptv_bulk")], [InlineKeyboardButton("🔙", callback_data="back")]]
     await update.callback_query.edit_message_text(msg, reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
 
 async def iptv_add_start(update, context): await update.callback_query.edit_message_text("👤 **Nome:**"); return IPTV_NAME
@@ -325,16 +1761,16 @@ async def iptv_save_val(update, context):
     try:
         v = float(update.message.text.replace(',', '.'))
         c = {"id": str(uuid.uuid4())[:8], "name": context.user_data["vn"], "phone": context.user_data["vp"], "day": context.user_data["vd"], "value": v}
-        db["iptv_clients"].append(c); save_db(db); await update.message.reply_text(f"✅ Salvo!"); return await start(update, context)
+        IPTV.add(c); save_db(db, "iptv_clients"); await update.message.reply_text(f"✅ Salvo!"); return await start(update, context)
     except: await update.message.reply_text("❌ Valor inválido."); return IPTV_VAL
 async def iptv_list(update, context):
     if not db["iptv_clients"]: await update.callback_query.edit_message_text("Vazio.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙", callback_data="menu_iptv")]])); return
-    kb = []; sorted_clients = sorted(db["iptv_clients"], key=lambda x: int(x['day']))
+    kb = []; sorted_clients = IPTV.sorted()
     for c in sorted_clients: kb.append([InlineKeyboardButton(f"{c['day']:02d} | {c['name']} (R$ {c.get('value',0):.0f})", callback_data=f"iptv_manage_{c['id']}")])
     kb.append([InlineKeyboardButton("🔙", callback_data="menu_iptv")]); await update.callback_query.edit_message_text("📋 **Clientes:**", reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
 
 async def iptv_manage_client(update, context):
-    cid = update.callback_query.data.replace("iptv_manage_", ""); client = next((c for c in db["iptv_clients"] if c["id"] == cid), None)
+    cid = update.callback_query.data.replace("iptv_manage_", ""); client = IPTV.get(cid)
     if not client: await iptv_list(update, context); return
     msg = f"👤 **{client['name']}**\nVence dia {client['day']}\nPlano: R$ {client.get('value',0):.2f}"
     # DOIS BOTÕES DE COBRANÇA AGORA
@@ -347,9 +1783,9 @@ async def iptv_manage_client(update, context):
     await update.callback_query.edit_message_text(msg, reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
 
 async def iptv_pay_confirm(update, context):
-    cid = update.callback_query.data.replace("iptv_pay_", ""); client = next((c for c in db["iptv_clients"] if c["id"] == cid), None)
+    cid = update.callback_query.data.replace("iptv_pay_", ""); client = IPTV.get(cid)
     if not client: return
-    val = client.get("value", 0); db["transactions"].append({"id": str(uuid.uuid4())[:8], "type": "ganho", "value": val, "category": "Vendas/IPTV", "description": f"IPTV - {client['name']}", "date": get_now().strftime("%d/%m/%Y %H:%M")}); save_db(db)
+    val = client.get("value", 0); add_transaction({"id": str(uuid.uuid4())[:8], "type": "ganho", "value": val, "category": "Vendas/IPTV", "description": f"IPTV - {client['name']}", "date": get_now().strftime("%d/%m/%Y %H:%M")}); save_db(db)
     await update.callback_query.answer(f"💰 + R$ {val}!"); await iptv_list(update, context)
 
 async def iptv_edit_menu(update, context): 
@@ -359,33 +1795,110 @@ async def iptv_edit_menu(update, context):
 async def iptv_edit_ask(update, context): context.user_data["edit_field"] = update.callback_query.data.replace("edit_", ""); await update.callback_query.edit_message_text("Novo valor:"); return IPTV_EDIT_VAL
 async def iptv_edit_save(update, context):
     cid = context.user_data.get("edit_id"); field = context.user_data.get("edit_field"); val = update.message.text
-    for c in db["iptv_clients"]: 
-        if c["id"] == cid: 
-            if field=="day": c[field]=int(val)
-            elif field=="value": c[field]=float(val.replace(',','.'))
-            else: c[field]=val
-    save_db(db); await update.message.reply_text("✅ Feito!"); return await start(update, context)
+    if field=="day": val=int(val)
+    elif field=="value": val=float(val.replace(',','.'))
+    IPTV.update(cid, field, val)
+    save_db(db, "iptv_clients"); await update.message.reply_text("✅ Feito!"); return await start(update, context)
 
 # --- MENSAGEM PADRÃO (ATUALIZADA) ---
 async def iptv_gen_msg(update, context):
-    cid = update.callback_query.data.replace("iptv_msg_", ""); client = next((c for c in db["iptv_clients"] if c["id"] == cid), None)
-    now = get_now(); dia = int(client['day']); m = now.month + 1 if now.day > dia else now.month; ano = now.year + 1 if m == 1 and now.month == 12 else now.year
-    data_formatada = f"{dia:02d}/{m:02d}/{ano}"
-    txt = f"""Olá querido(a) cliente {client['name']}\n\nSUA CONTA EXPIRA EM BREVE!\n\nSeu plano vence em:\n{data_formatada}\n\nEvite o bloqueio automático do seu sinal\n\nPara renovar o seu plano agora, faça o\npix no seguinte pix:\n\nPix: {MY_PIX_KEY}\nNome: David Vasconcellos\n\nPor favor, nos envie o comprovante de\npagamento assim que possível.\n\n⚠️ Mensagem automática: Caso já tenha pago, ignore esta mensagem.\n\nÉ sempre um prazer te atender."""
-    await update.callback_query.message.reply_text(f"`{txt}`", parse_mode="Markdown"); await update.callback_query.answer()
+    cid = update.callback_query.data.replace("iptv_msg_", ""); client = IPTV.get(cid)
+    if not client: await update.callback_query.answer("Cliente não encontrado."); return
+    await update.callback_query.message.reply_text(f"`{bill_text(client, get_now().date())}`", parse_mode="Markdown"); await update.callback_query.answer()
+
+def bill_text(client, today):
+    data_formatada = IPTV.next_due(client, today).strftime("%d/%m/%Y")
+    return f"""Olá querido(a) cliente {client['name']}\n\nSUA CONTA EXPIRA EM BREVE!\n\nSeu plano vence em:\n{data_formatada}\n\nEvite o bloqueio automático do seu sinal\n\nPara renovar o seu plano agora, faça o\npix no seguinte pix:\n\nPix: {MY_PIX_KEY}\nNome: David Vasconcellos\n\nPor favor, nos envie o comprovante de\npagamento assim que possível.\n\n⚠️ Mensagem automática: Caso já tenha pago, ignore esta mensagem.\n\nÉ sempre um prazer te atender."""
 
 # --- NOVA MENSAGEM DE ATRASO (V119 - CORRIGIDA) ---
 async def iptv_late_msg(update, context):
-    cid = update.callback_query.data.replace("iptv_late_", ""); client = next((c for c in db["iptv_clients"] if c["id"] == cid), None)
-    now = get_now(); dia = int(client['day']); data_formatada = f"{dia:02d}/{now.month:02d}"
-    txt = f"""⚠️ **AVISO DE SUSPENSÃO**\n\nOlá, {client['name']}.\nConsta em aberto a sua renovação vencida em: **{data_formatada}**.\n\n**O seu sinal entrou na lista de bloqueio automático e pode parar a qualquer momento.**\n\nPara manter o serviço ativo, regularize agora:\n\n💠 **Pix:** {MY_PIX_KEY}\n👤 **Nome:** David Vasconcellos\n\n*Envie o comprovante para reativação imediata.*\n\n⚠️ **Mensagem automática:** Caso já tenha efetuado o pagamento, por favor, desconsidere este aviso."""
-    await update.callback_query.message.reply_text(f"`{txt}`", parse_mode="Markdown"); await update.callback_query.answer()
+    cid = update.callback_query.data.replace("iptv_late_", ""); client = IPTV.get(cid)
+    if not client: await update.callback_query.answer("Cliente não encontrado."); return
+    await update.callback_query.message.reply_text(f"`{late_text(client, get_now().date())}`", parse_mode="Markdown"); await update.callback_query.answer()
+
+def late_text(client, today):
+    data_formatada = IPTV.last_due(client, today).strftime("%d/%m")
+    return f"""⚠️ **AVISO DE SUSPENSÃO**\n\nOlá, {client['name']}.\nConsta em aberto a sua renovação vencida em: **{data_formatada}**.\n\n**O seu sinal entrou na lista de bloqueio automático e pode parar a qualquer momento.**\n\nPara manter o serviço ativo, regularize agora:\n\n💠 **Pix:** {MY_PIX_KEY}\n👤 **Nome:** David Vasconcellos\n\n*Envie o comprovante para reativação imediata.*\n\n⚠️ **Mensagem automática:** Caso já tenha efetuado o pagamento, por favor, desconsidere este aviso."""
+
+# --- COBRANÇA EM LOTE ---
+BILL_GRACE_DAYS = int(os.getenv("BILL_GRACE_DAYS", "5"))  # pagamento até N dias antes do vencimento já quita o ciclo
+BILL_RUNS = {}  # chat -> task da cobrança em andamento
+
+def iptv_last_paid():
+    """Nome do cliente -> ts do último pagamento registrado (iptv_pay_confirm grava "IPTV - nome" em Vendas/IPTV)."""
+    if not TXINDEX.ready: TXINDEX.build()
+    last = {}
+    for t in TXINDEX.cats.get("vendas/iptv", ()):
+        if t.ts is not None and t.description and t.description.startswith("IPTV - "):
+            n = t.description[7:]; last[n] = max(last.get(n, -1), t.ts)
+    return last
+
+def billing_targets(today):
+    """(vencem amanhã, em atraso) entre os clientes que ainda não pagaram o ciclo. Atraso = o último
+    vencimento já passou e não há pagamento desde BILL_GRACE_DAYS dias antes dele."""
+    paid = iptv_last_paid(); tomorrow = today + timedelta(days=1); grace = timedelta(days=BILL_GRACE_DAYS)
+    due = [c for c in IPTV.due_on(tomorrow) if paid.get(c["name"], -1) < to_ts(tomorrow - grace)]; skip = {c["id"] for c in IPTV.due_on(tomorrow)}
+    late = []
+    for c in IPTV.sorted():
+        if c["id"] in skip or IPTV.day_of(c) is None: continue
+        last = IPTV.last_due(c, today)
+        if last < today and paid.get(c["name"], -1) < to_ts(last - grace): late.append(c)
+    return due, late
+
+def wa_button(client, txt):
+    """Botão que abre o WhatsApp do cliente com a mensagem pronta (DDI 55 se o número vier sem)."""
+    digits = re.sub(r"\D", "", str(client.get("phone", "")))
+    if len(digits) < 10: return None
+    if len(digits) <= 11: digits = "55" + digits
+    return InlineKeyboardMarkup([[InlineKeyboardButton("📲 Enviar no WhatsApp", url=f"https://wa.me/{digits}?text={urllib.parse.quote(txt)}")]])
+
+def billing_jobs(due_ids, late_ids, today):
+    """Renderiza as cobranças numa passada: [(nome, atrasado?, kwargs do send_message)]. Roda no handler,
+    com o tenant carregado; o envio depois não toca mais no banco."""
+    jobs = []
+    for ids, late in ((due_ids, False), (late_ids, True)):
+        for cid in ids:
+            c = IPTV.get(cid)
+            if c: txt = (late_text if late else bill_text)(c, today); jobs.append((c["name"], late, {"text": f"`{txt}`", "parse_mode": "Markdown", "reply_markup": wa_button(c, txt)}))
+    return jobs
+
+async def billing_run(bot, chat_id, jobs, status=None):
+    """Despeja as cobranças na OUTBOX, espera a fila do chat esvaziar e manda o resumo. Devolve as contagens."""
+    t0 = time.perf_counter(); box = outbox(bot); st = Counter()
+    futs = [box.send(chat_id, st, **kw) for *_, kw in jobs]
+    if status:
+        with contextlib.suppress(Exception): await status.edit_text(f"📤 Enviando {len(jobs)} cobranças (~{len(jobs) / box.rate(chat_id):.0f}s)...")
+    res = await asyncio.gather(*futs, return_exceptions=True)
+    fails = [name for (name, *_), r in zip(jobs, res) if isinstance(r, Exception)]
+    sent = Counter(late for (_, late, _), r in zip(jobs, res) if not isinstance(r, Exception))
+    txt = (f"✅ **Cobrança concluída** ({time.perf_counter() - t0:.0f}s)\nVencem amanhã: {sent[False]} | Em atraso: {sent[True]}"
+           + (f"\n⚠️ Falharam ({len(fails)}): {', '.join(fails[:20])}" if fails else "") + (f"\n🔁 429: {st['429']} | Rede: {st['retry']}" if st["429"] or st["retry"] else ""))
+    with contextlib.suppress(Exception): await box.send(chat_id, text=txt, parse_mode="Markdown")
+    logger.info(f"Cobrança em lote: {sum(sent.values())} enviadas, {len(fails)} falhas, {st['429']} 429, {time.perf_counter() - t0:.1f}s")
+    return {"sent_due": sent[False], "sent_late": sent[True], "failed": fails, "429": st["429"], "retry": st["retry"], "secs": time.perf_counter() - t0}
+
+async def iptv_bulk(update, context):
+    due, late = billing_targets(get_now().date())
+    context.user_data["bill"] = ([c["id"] for c in due], [c["id"] for c in late])
+    names = lambda cs: ", ".join(c["name"] for c in cs[:8]) + ("..." if len(cs) > 8 else "")
+    txt = f"📤 **Cobrança em lote**\n\n📅 Vencem amanhã: **{len(due)}**" + (f"\n{names(due)}" if due else "") + f"\n⏳ Em atraso: **{len(late)}**" + (f"\n{names(late)}" if late else "")
+    kb = [[InlineKeyboardButton(f"📤 Gerar {len(due) + len(late)} mensagens", callback_data="iptv_go_bulk")]] if due or late else []
+    kb.append([InlineKeyboardButton("🔙", callback_data="menu_iptv")])
+    await update.callback_query.edit_message_text(txt + ("\n\nCada mensagem chega aqui com o botão do WhatsApp do cliente." if due or late else "\n\nNinguém para cobrar."), reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
+
+async def iptv_go_bulk(update, context):
+    chat = update.effective_chat.id; ids = context.user_data.pop("bill", None)
+    if chat in BILL_RUNS and not BILL_RUNS[chat].done(): await update.callback_query.answer("Já tem uma cobrança em andamento."); return
+    if not ids: await update.callback_query.answer("Abra a cobrança de novo."); return
+    await update.callback_query.answer(); jobs = billing_jobs(*ids, get_now().date())
+    status = await update.callback_query.edit_message_text("📤 Preparando cobranças...")
+    BILL_RUNS[chat] = asyncio.create_task(billing_run(context.bot, chat, jobs, status=status))
 
 async def iptv_kill(update, context): 
-    cid = update.callback_query.data.replace("iptv_kill_", ""); db["iptv_clients"] = [c for c in db["iptv_clients"] if c["id"] != cid]; save_db(db); await update.callback_query.answer("🗑️"); await iptv_list(update, context)
+    cid = update.callback_query.data.replace("iptv_kill_", ""); IPTV.remove(cid); save_db(db, "iptv_clients"); await update.callback_query.answer("🗑️"); await iptv_list(update, context)
 
 # ================= RESTO =================
-async def undo_quick(update, context): query = update.callback_query; await query.answer(); db["transactions"].pop() if db["transactions"] else None; save_db(db); await query.edit_message_text("Desfeito!")
+async def undo_quick(update, context): query = update.callback_query; await query.answer(); remove_transaction(db["transactions"][-1]["id"]) if db["transactions"] else None; save_db(db); await query.edit_message_text("Desfeito!")
 async def manual_gasto_trigger(update, context): context.user_data["t"] = "gasto"; await update.message.reply_text("💸 Valor?"); return REG_VALUE
 async def manual_ganho_trigger(update, context): context.user_data["t"] = "ganho"; await update.message.reply_text("💰 Valor?"); return REG_VALUE
 async def reg_start(update, context): await start(update, context); return REG_TYPE
@@ -394,7 +1907,7 @@ async def reg_val(update, context): context.user_data["v"] = float(update.messag
 async def reg_cat(update, context): context.user_data["c"] = update.callback_query.data.replace("sc_", ""); kb = [[InlineKeyboardButton("⏩ Pular", callback_data="skip_d")]]; await update.callback_query.edit_message_text("Descrição?", reply_markup=InlineKeyboardMarkup(kb)); return REG_DESC
 async def reg_fin(update, context):
     desc = context.user_data["c"] if update.callback_query else update.message.text
-    db["transactions"].append({"id":str(uuid.uuid4())[:8], "type":context.user_data["t"], "value":context.user_data["v"], "category":context.user_data["c"], "description":desc, "date":get_now().strftime("%d/%m/%Y %H:%M")})
+    add_transaction({"id":str(uuid.uuid4())[:8], "type":context.user_data["t"], "value":context.user_data["v"], "category":context.user_data["c"], "description":desc, "date":get_now().strftime("%d/%m/%Y %H:%M")})
     save_db(db); msg = f"✅ Registrado!"; await (update.callback_query.edit_message_text if update.callback_query else update.message.reply_text)(msg); return await start(update, context)
 
 # OUTROS MENUS
@@ -402,55 +1915,50 @@ async def menu_debts(update, context): txt="🧾 Dívidas:"; kb=[[InlineKeyboard
 async def add_person_start(update, context): await update.callback_query.edit_message_text("Nome:"); return DEBT_NAME
 async def save_person_name(update, context): context.user_data["new_debt_name"] = update.message.text; await update.message.reply_text(f"Quanto {update.message.text} deve? (0 se nada)"); return DEBT_INIT_VAL
 async def save_person_val(update, context):
-    try: val = float(update.message.text.replace(',', '.')); name = context.user_data["new_debt_name"]; db["debts_v2"][name] = val; save_db(db); await update.message.reply_text("✅ Salvo!"); return await start(update, context)
+    try: val = float(update.message.text.replace(',', '.')); name = context.user_data["new_debt_name"]; db["debts_v2"][name] = val; save_db(db, "debts_v2"); await update.message.reply_text("✅ Salvo!"); return await start(update, context)
     except: await update.message.reply_text("Valor inválido."); return DEBT_INIT_VAL
 async def edit_debt_menu(update, context): context.user_data["dn"] = update.callback_query.data.replace("ed_", ""); kb=[[InlineKeyboardButton("➕ Emprestei", callback_data="da_add"), InlineKeyboardButton("➖ Pagou", callback_data="da_sub")], [InlineKeyboardButton("🗑️", callback_data="da_del"), InlineKeyboardButton("🔙", callback_data="menu_debts")]]; await update.callback_query.edit_message_text(f"👤 {context.user_data['dn']}", reply_markup=InlineKeyboardMarkup(kb))
 async def debt_action(update, context): 
     act=update.callback_query.data; n=context.user_data["dn"] 
-    if "del" in act: del db["debts_v2"][n]; save_db(db); await menu_debts(update, context); return
+    if "del" in act: del db["debts_v2"][n]; save_db(db, "debts_v2"); await menu_debts(update, context); return
     context.user_data["da"] = "add" if "add" in act else "sub"; await update.callback_query.edit_message_text("Valor?"); return DEBT_VAL
-async def debt_save_val(update, context): v=float(update.message.text.replace(',','.')); n=context.user_data["dn"]; v=-v if context.user_data["da"]=="sub" else v; db["debts_v2"][n]+=v; save_db(db); await update.message.reply_text("Ok!"); return await start(update, context)
+async def debt_save_val(update, context): v=float(update.message.text.replace(',','.')); n=context.user_data["dn"]; v=-v if context.user_data["da"]=="sub" else v; db["debts_v2"][n]+=v; save_db(db, "debts_v2"); await update.message.reply_text("Ok!"); return await start(update, context)
 
 async def menu_shop(update, context): l=db["shopping_list"]; txt="🛒 Lista:\n"+"\n".join(l); kb=[[InlineKeyboardButton("Limpar", callback_data="sl_c"), InlineKeyboardButton("🔙", callback_data="back")]]; await update.callback_query.edit_message_text(txt, reply_markup=InlineKeyboardMarkup(kb))
-async def sl_c(update, context): db["shopping_list"]=[]; save_db(db); await start(update, context)
-async def rep_list(update, context): t=db["transactions"][-10:]; txt="\n".join([f"{x['type']} {x['value']} ({x['description']})" for x in t]); await update.callback_query.edit_message_text(txt, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙", callback_data="menu_reports")]]))
-async def menu_manage_trans(update, context): kb=[[InlineKeyboardButton(f"🗑️ {t['value']} ({t['description']})", callback_data=f"del_tr_{t['id']}")] for t in db["transactions"][-5:]]; kb.append([InlineKeyboardButton("🔙", callback_data="menu_reports")]); await update.callback_query.edit_message_text("Apagar:", reply_markup=InlineKeyboardMarkup(kb))
-async def delete_transaction_confirm(update, context): tid=update.callback_query.data.replace("del_tr_", ""); db["transactions"]=[t for t in db["transactions"] if t['id']!=tid]; save_db(db); await update.callback_query.answer("Apagado!"); await menu_manage_trans(update, context)
+async def sl_c(update, context): db["shopping_list"]=[]; save_db(db, "shopping_list"); await start(update, context)
+async def menu_manage_trans(update, context): await rep_list(update, context)
+async def delete_transaction_confirm(update, context):
+    tid=update.callback_query.data.replace("del_tr_", ""); remove_transaction(tid); save_db(db); await update.callback_query.answer("Apagado!")
+    txt, kb = statement_view(context.user_data.setdefault("st", {"q": {}, "at": None})); await update.callback_query.edit_message_text(txt, reply_markup=kb, parse_mode="Markdown")
 async def rep_insights(update, context): await update.callback_query.answer("Use o botão Vidente IPTV para previsão."); await menu_reports(update, context)
 async def rep_pie(update, context): 
-    await update.callback_query.answer("Gerando..."); cats={}; m=get_now().strftime("%m/%Y")
-    for t in db["transactions"]: 
-        if t['type']=='gasto' and m in t['date']: cats[t['category']]=cats.get(t['category'],0)+t['value']
+    await update.callback_query.answer("Gerando..."); m=get_now().strftime("%m/%Y"); cats=month_group("gasto", m, "category")
     if not cats: await update.callback_query.message.reply_text("Sem dados."); return
-    plt.clf(); fig, ax = plt.subplots(figsize=(6, 4)); ax.pie(cats.values(), autopct='%1.1f%%', startangle=90, colors=COLORS); ax.legend(cats.keys(), loc="best"); buf = io.BytesIO(); plt.savefig(buf, format='png'); buf.seek(0); plt.close(); await update.callback_query.message.reply_photo(buf)
-async def rep_pdf(update, context): 
-    c = canvas.Canvas("relatorio.pdf", pagesize=letter); c.drawString(50, 750, "EXTRATO"); y = 700
-    for t in reversed(db["transactions"][-40:]): c.drawString(50, y, f"{t['date']} | R$ {t['value']:.2f} | {t['description']}"); y -= 20
-    c.save(); 
-    with open("relatorio.pdf", "rb") as f: await update.callback_query.message.reply_document(f)
+    entry = await chart("pie", m, ROLLUP_VER.get(m, 0), render_pie, cats); await send_chart(update.callback_query.message, entry)
+async def rep_pdf(update, context): await update.callback_query.answer("Gerando PDF..."); await send_export(update.callback_query.message, "pdf", newest_first=True)
 
 async def menu_cats(update, context): await update.callback_query.edit_message_text("Categorias:", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("➕", callback_data="c_add"), InlineKeyboardButton("❌", callback_data="c_del"), InlineKeyboardButton("🔙", callback_data="back")]]))
 async def c_add(update, context): await update.callback_query.edit_message_text("Tipo:", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Gasto", callback_data="nc_gasto"), InlineKeyboardButton("Ganho", callback_data="nc_ganho")]])); return CAT_ADD_TYPE
 async def c_type(update, context): context.user_data["nt"] = update.callback_query.data.replace("nc_", ""); await update.callback_query.edit_message_text("Nome:"); return CAT_ADD_NAME
-async def c_save(update, context): db["categories"][context.user_data["nt"]].append(update.message.text); save_db(db); await update.message.reply_text("Ok!"); return await start(update, context)
+async def c_save(update, context): db["categories"][context.user_data["nt"]].append(update.message.text); save_db(db, "categories"); await update.message.reply_text("Ok!"); return await start(update, context)
 async def c_del(update, context): kb=[[InlineKeyboardButton(c, callback_data=f"kc_gasto_{c}")] for c in db["categories"]["gasto"]]; kb.append([InlineKeyboardButton("🔙", callback_data="back")]); await update.callback_query.edit_message_text("Del:", reply_markup=InlineKeyboardMarkup(kb))
-async def c_kill(update, context): _, t, n = update.callback_query.data.split("_"); db["categories"][t].remove(n); save_db(db); await update.callback_query.edit_message_text("Del!", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙", callback_data="back")]]))
+async def c_kill(update, context): _, t, n = update.callback_query.data.split("_"); db["categories"][t].remove(n); save_db(db, "categories"); await update.callback_query.edit_message_text("Del!", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙", callback_data="back")]]))
 
 # ================= CONFIG / PERSONA / SUBS =================
 async def menu_conf(update, context):
     p = "🔴" if db["config"]["panic_mode"] else "🟢"; persona_atual = db["config"].get("persona", "padrao").title()
     kb = [[InlineKeyboardButton(f"Pânico: {p}", callback_data="tg_panic"), InlineKeyboardButton(f"🎭 IA: {persona_atual}", callback_data="menu_persona")], [InlineKeyboardButton("🔔 Assinaturas", callback_data="menu_subs")], [InlineKeyboardButton("🔙", callback_data="back")]]
     await update.callback_query.edit_message_text("⚙️ **Configurações:**", reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
-async def tg_panic(update, context): db["config"]["panic_mode"] = not db["config"]["panic_mode"]; save_db(db); await menu_conf(update, context)
+async def tg_panic(update, context): db["config"]["panic_mode"] = not db["config"]["panic_mode"]; save_db(db, "config"); await menu_conf(update, context)
 async def menu_persona(update, context): kb = [[InlineKeyboardButton("🧔🏿‍♂️ Julius", callback_data="sp_julius"), InlineKeyboardButton("🤡 Zoeiro", callback_data="sp_zoeiro")], [InlineKeyboardButton("👔 Padrão", callback_data="sp_padrao")], [InlineKeyboardButton("🔙", callback_data="menu_conf")]]; await update.callback_query.edit_message_text("🎭 **Personalidade da IA:**", reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
-async def set_persona(update, context): db["config"]["persona"] = update.callback_query.data.replace("sp_", ""); save_db(db); await update.callback_query.answer("Atualizado!"); await menu_conf(update, context)
+async def set_persona(update, context): db["config"]["persona"] = update.callback_query.data.replace("sp_", ""); save_db(db, "config"); await update.callback_query.answer("Atualizado!"); await menu_conf(update, context)
 async def menu_subs(update, context):
     subs = db.get("subscriptions", []); txt = f"🔔 **ASSINATURAS**\nTotal: **R$ {sum(float(s['val']) for s in subs):.2f}**\n\n" + "\n".join([f"• {s['name']} (Dia {s['day']}): R$ {s['val']}" for s in subs]); kb = [[InlineKeyboardButton("➕ Add (/sub)", callback_data="sub_add"), InlineKeyboardButton("🗑️ Del", callback_data="sub_del")], [InlineKeyboardButton("🔙", callback_data="menu_conf")]]; await update.callback_query.edit_message_text(txt, reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
 async def sub_add_help(update, context): await update.callback_query.answer(); await update.callback_query.message.reply_text("Use:\n`/sub Netflix 55.90 15`")
 async def sub_cmd(update, context): 
-    try: n, v, d = context.args[0], float(context.args[1].replace(',', '.')), int(context.args[2]); db["subscriptions"].append({"name": n, "val": v, "day": d}); save_db(db); await update.message.reply_text("✅ Conta salva!")
+    try: n, v, d = context.args[0], float(context.args[1].replace(',', '.')), int(context.args[2]); db["subscriptions"].append({"name": n, "val": v, "day": d}); save_db(db, "subscriptions"); await update.message.reply_text("✅ Conta salva!")
     except: await update.message.reply_text("Erro. Use: `/sub Nome Valor Dia`")
-async def sub_del_menu(update, context): db["subscriptions"] = []; save_db(db); await menu_subs(update, context)
+async def sub_del_menu(update, context): db["subscriptions"] = []; save_db(db, "subscriptions"); await menu_subs(update, context)
 
 # --- AGENDA (COM SUPORTE IA) ---
 async def menu_agenda(update, context): 
@@ -458,65 +1966,562 @@ async def menu_agenda(update, context):
     if not rems: txt = "_Nenhum lembrete._"
     else: txt = "\n".join([f"• {r['time']}: {r['text']}" for r in rems])
     await update.callback_query.edit_message_text(f"⏰ **AGENDA:**\n\n{txt}\n\n_Para adicionar, fale: 'Me lembre de pagar X amanhã'_", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Limpar", callback_data="del_agenda_all"), InlineKeyboardButton("🔙", callback_data="back")]], parse_mode="Markdown"))
-async def agenda_del(update, context): db["reminders"]=[]; save_db(db); await start(update, context)
+async def agenda_del(update, context): db["reminders"]=[]; save_db(db, "reminders"); await start(update, context)
 async def menu_help(update, context): await update.callback_query.edit_message_text("Ajuda: Use o menu.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙", callback_data="back")]]))
-async def backup(update, context): 
-    with open(DB_FILE, "rb") as f: await update.callback_query.message.reply_document(f)
-async def admin_panel(update, context): await update.callback_query.edit_message_text("Admin", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙", callback_data="back")]]))
+async def backup(update, context): await update.callback_query.answer("Gerando backup..."); await send_backup(context.bot, update.effective_chat.id, full=True)
+async def admin_panel(update, context):
+    txt = f"Admin\n\n⚡ Parser local: {parse_hit_rate():.0%} sem IA (local {PARSE_STATS['local']}, cache {PARSE_STATS['cache']}, Gemini {PARSE_STATS['llm']})"
+    if TENANT_MODE: txt += f"\n👥 Partições carregadas: {len(TENANTS.loaded)}/{TENANT_MAX} (de {len(tenant_ids())})"
+    txt += f"\n🚀 Partida: import {STARTUP['import']:.2f}s, pronto {STARTUP['ready'] or 0:.2f}s\n🤖 {MODEL_STATUS}"
+    await update.callback_query.edit_message_text(txt, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙", callback_data="back")]]))
 async def roleta(update, context): await update.callback_query.edit_message_text("Girar", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Girar", callback_data="roleta"), InlineKeyboardButton("🔙", callback_data="back")]]))
 
+# --- PARSER LOCAL (antes da IA) ---
+# Frases comuns ("Gastei 50 mercado", "Recebi 100", "Me lembre de pagar a luz dia 20 às 14h") saem daqui
+# no mesmo formato JSON que o Gemini devolve; só o que não casar com confiança vai para a IA.
+VERB_GASTO = {"gastei", "paguei", "comprei", "gasto", "gastos", "debito", "débito"}
+VERB_GANHO = {"recebi", "ganhei", "entrou", "vendi", "ganho", "recebido", "recebimento"}
+DAYS_BACK = {"hoje": 0, "ontem": 1, "anteontem": 2}  # data relativa resolvida localmente (e tirada da descrição)
+DATE_WORDS = {"amanhã", "amanha", "passado", "passada", "retrasado", "retrasada", "semana", "segunda", "terça", "terca",
+              "quarta", "quinta", "sexta", "sábado", "sabado", "domingo"}  # outras datas: fica para o Gemini
+FILLER = {"eu", "hoje", "de", "do", "da", "no", "na", "em", "com", "o", "a", "os", "as", "um", "uma", "pra", "para", "r$", "reais", "real", "conto", "contos", "pila"}
+CAT_HINTS = {"uber": "Transporte", "99": "Transporte", "onibus": "Transporte", "ônibus": "Transporte", "gasolina": "Transporte", "combustivel": "Transporte",
+             "ifood": "Alimentação", "lanche": "Alimentação", "almoço": "Alimentação", "almoco": "Alimentação", "jantar": "Alimentação", "pizza": "Alimentação",
+             "supermercado": "Mercado", "feira": "Mercado", "cinema": "Lazer", "bar": "Lazer", "aluguel": "Casa", "luz": "Casa", "água": "Casa", "agua": "Casa",
+             "salário": "Salário", "salario": "Salário", "iptv": "Vendas/IPTV"}
+RE_AMOUNT = re.compile(r"^(?:r\$)?(\d{1,3}(?:\.\d{3})+(?:,\d{1,2})?|\d+(?:[.,]\d{1,2})?)(?:r\$|reais)?$", re.I)
+RE_REMIND = re.compile(r"^(?:me\s+)?(?:lembre|lembra|lembrar|avise|avisa)(?:-me|\s+me)?\s+(?:de\s+|que\s+)?", re.I)
+RE_HOUR = re.compile(r"\s*\b(?:(?:às|as|a)\s+)?(\d{1,2})(?:h|:)(\d{2})?(?:h|min)?\b", re.I)
+RE_DAY = re.compile(r"\s*\b(?:(?:no\s+)?dia\s+(\d{1,2})(?:/(\d{1,2}))?|depois\s+de\s+amanh[ãa]|amanh[ãa]|hoje|(?:na\s+|no\s+)?(segunda|ter[çc]a|quarta|quinta|sexta|s[áa]bado|domingo)(?:-feira)?|em\s+(\d{1,3})\s+dias?)\b", re.I)
+RE_SHOP = re.compile(r"^(?:adiciona|adicionar|add|coloca|colocar|bota|botar)\s+(.+?)\s+na\s+lista$", re.I)
+WEEKDAYS = ["segunda", "terca", "quarta", "quinta", "sexta", "sabado", "domingo"]
+
+def parse_amount(tok):
+    m = RE_AMOUNT.match(tok)
+    if not m: return None
+    s = m.group(1)
+    if "," in s: s = s.replace(".", "").replace(",", ".")
+    elif re.fullmatch(r"\d{1,3}(?:\.\d{3})+", s): s = s.replace(".", "")  # 1.500 = mil e quinhentos, 1.000.000 = um milhão
+    return float(s)
+
+def match_category(words, kind):
+    cats = db["categories"].get(kind, [])
+    low = {c.lower(): c for c in cats}
+    for w in words:
+        if w in low: return low[w]
+        hint = CAT_HINTS.get(w)
+        if hint in cats: return hint
+    for w in words:  # prefixo: "merc" -> "Mercado", "alimenta" -> "Alimentação"
+        if len(w) >= 4:
+            for k, c in low.items():
+                if k.startswith(w) or w.startswith(k): return c
+    return None
+
+def parse_when(text, now):
+    """Extrai dia/hora relativos de `text`. Retorna (texto restante, datetime) ou (texto, None)."""
+    day = None; hour = None
+    m = RE_DAY.search(text)
+    if m:
+        w = m.group(0).strip().lower()
+        if m.group(1):
+            d, mo = int(m.group(1)), int(m.group(2) or now.month); y = now.year
+            try:
+                day = datetime(y, mo, d)
+                if day.date() < now.date(): day = datetime(y + 1, mo, d) if m.group(2) else day + relativedelta(months=1)
+            except ValueError: return text, None
+        elif w.startswith("depois"): day = now + timedelta(days=2)
+        elif w.startswith("amanh"): day = now + timedelta(days=1)
+        elif w == "hoje": day = now
+        elif m.group(4): day = now + timedelta(days=int(m.group(4)))
+        else:
+            wd = WEEKDAYS.index(m.group(3).lower().replace("ç", "c").replace("á", "a")); delta = (wd - now.weekday()) % 7 or 7
+            day = now + timedelta(days=delta)
+        text = text[:m.start()] + text[m.end():]
+    h = RE_HOUR.search(text)
+    if h and int(h.group(1)) < 24 and int(h.group(2) or 0) < 60:
+        hour = (int(h.group(1)), int(h.group(2) or 0)); text = text[:h.start()] + text[h.end():]
+    if day is None and hour is None: return text, None
+    hh, mm = hour or (9, 0)
+    when = (day or now).replace(hour=hh, minute=mm, second=0, microsecond=0)
+    if day is None and when <= now: when += timedelta(days=1)
+    return text, when
+
+def parse_local(text, now):
+    """Retorna (data, confiável). `data` segue o formato das respostas do Gemini ou é None."""
+    s = " ".join(text.strip().split())
+    if not s: return None, False
+    m = RE_SHOP.match(s)
+    if m: return {"type": "mercado", "item": m.group(1)}, True
+    m = RE_REMIND.match(s)
+    if m:
+        rest, when = parse_when(s[m.end():], now); rest = " ".join(rest.split()).strip(" ,.")
+        if not when or not rest: return None, False
+        return {"type": "agenda", "text": rest[:1].upper() + rest[1:], "time": when.strftime("%Y-%m-%d %H:%M")}, True
+    orig = s.split(); words = s.lower().split(); back = 0
+    for i in range(len(words) - 1, -1, -1):
+        w = words[i].strip(",.!")
+        if w in DAYS_BACK: back = DAYS_BACK[w]; del words[i], orig[i]
+        elif w in DATE_WORDS: return None, False
+    while words and words[0] == "eu": words.pop(0); orig.pop(0)
+    if not words: return None, False
+    kind = "gasto" if words[0] in VERB_GASTO else "ganho" if words[0] in VERB_GANHO else None
+    if not kind: return None, False
+    vals = [(i, v) for i, v in ((i, parse_amount(w)) for i, w in enumerate(words[1:], 1)) if v is not None]
+    if len(vals) != 1: return None, False
+    keep = [i for i in range(1, len(words)) if i != vals[0][0] and words[i] not in FILLER]
+    cat = match_category([words[i] for i in keep], kind)
+    desc = " ".join(orig[i] for i in keep).strip(" ,.")
+    desc = desc[:1].upper() + desc[1:] if desc else None
+    default = "Extra" if kind == "ganho" else "Geral"
+    data = {"type": kind, "val": vals[0][1], "cat": cat or default, "desc": desc or cat or default}
+    if back: data["date"] = (now - timedelta(days=back)).strftime("%d/%m/%Y %H:%M")
+    return data, bool(cat) or kind == "ganho"
+
+# Memo de entradas idênticas (por dia, por causa de "amanhã"/"hoje") + contadores de acerto
+PARSE_CACHE = OrderedDict(); PARSE_CACHE_MAX = 512
+PARSE_STATS = {"local": 0, "cache": 0, "llm": 0}
+
+def memo_key(text, now): return (tenant_id(), " ".join(text.lower().split()), now.strftime("%Y-%m-%d"))  # categorias são do tenant
+
+def memo_put(key, data):
+    PARSE_CACHE[key] = data
+    while len(PARSE_CACHE) > PARSE_CACHE_MAX: PARSE_CACHE.popitem(last=False)
+
+def parse_fast(text, now, need_confident=True):
+    key = memo_key(text, now)
+    if key in PARSE_CACHE: PARSE_CACHE.move_to_end(key); PARSE_STATS["cache"] += 1; return dict(PARSE_CACHE[key])
+    data, sure = parse_local(text, now)
+    if data and (sure or not need_confident):
+        if sure: memo_put(key, data)
+        PARSE_STATS["local"] += 1; return dict(data)
+    return None
+
+def parse_hit_rate():
+    total = sum(PARSE_STATS.values())
+    return (PARSE_STATS["local"] + PARSE_STATS["cache"]) / total if total else 0.0
+
+async def apply_entry(update, data, say, now):
+    """Executa o JSON extraído (agenda, mercado ou transação). Retorna False se não reconheceu."""
+    if data.get('type') == 'agenda':
+        rem = {"text": data['text'], "time": data['time'], "chat_id": update.effective_chat.id}
+        db["reminders"].append(rem); sched_reminder(rem); save_db(db, "reminders"); await say(f"⏰ Agendado: {data['text']} para {data['time']}"); return True
+    if data.get('type') == 'mercado': db["shopping_list"].append(data['item']); save_db(db, "shopping_list"); await say(f"🛒 {data['item']}"); return True
+    if 'val' in data:
+        when = data.get('date') if parse_ts(str(data.get('date', ''))) is not None else now.strftime("%d/%m/%Y %H:%M")  # "ontem" do parser local
+        add_transaction({"id":str(uuid.uuid4())[:8], "type":data['type'], "value":float(data['val']), "category":data.get('cat','Geral'), "description":data.get('desc','IA'), "date":when})
+        save_db(db); await say(f"✅ R$ {float(data['val']):.2f} ({data.get('desc')})" + (f" em {when[:5]}" if 'date' in data and when == data['date'] else "")); return True
+    if data.get('msg'): await say(data['msg']); return True
+    return False
+
 # --- IA HANDLER ---
 @restricted
 async def smart_entry(update, context):
-    if not model_ai: await update.message.reply_text("⚠️ IA Offline."); return
-    msg = update.message; wait = await msg.reply_text("🧠..."); now = get_now()
+    msg = update.message; now = get_now()
+    if msg.text:
+        try: data = parse_fast(msg.text, now, need_confident=bool(GEMINI_KEY))
+        except Exception as e: logger.warning(f"Parser local falhou em {msg.text!r}: {e}"); data = None  # segue para a IA
+        if data and await apply_entry(update, data, msg.reply_text, now): return
+    model = await get_model()
+    if not model: await update.message.reply_text("⚠️ IA Offline."); return
+    wait = await msg.reply_text("🧠...")
     prompt = f"""SYSTEM: JSON Extractor. No chat.
     Date: {now}. Examples:
     Input: "Gastei 50 mercado" -> {{"type":"gasto", "val":50.0, "cat":"Mercado", "desc":"Mercado"}}
     Input: "Recebi 100" -> {{"type":"ganho", "val":100.0, "cat":"Extra", "desc":"Extra"}}
     Input: "Me lembre de pagar a luz dia 20 às 14h" -> {{"type":"agenda", "text":"Pagar a luz", "time":"2026-MM-20 14:00"}}
     User Input:"""
-    content = [prompt]
+    content = [prompt]; myfile = None
     if msg.voice or msg.audio:
+        f_path = f"audio_{uuid.uuid4()}.ogg"
         try:
-            fid = (msg.voice or msg.audio).file_id; f_obj = await context.bot.get_file(fid); f_path = f"audio_{uuid.uuid4()}.ogg"; await f_obj.download_to_drive(f_path)
-            myfile = genai.upload_file(f_path); 
-            while myfile.state.name == "PROCESSING": time.sleep(1); myfile = genai.get_file(myfile.name)
+            fid = (msg.voice or msg.audio).file_id; f_obj = await context.bot.get_file(fid); await f_obj.download_to_drive(f_path)
+            myfile = await ai_upload(f_path)
             content.append(myfile); content.append("Transcreva e extraia JSON.")
-        except: await wait.edit_text("Erro áudio."); return
+        except: 
+            if myfile: ai_discard(myfile)
+            await wait.edit_text("Erro áudio."); return
+        finally:
+            if os.path.exists(f_path): os.remove(f_path)
     elif msg.photo:
         f = await context.bot.get_file(msg.photo[-1].file_id); d = await f.download_as_bytearray()
         content.append({"mime_type": "image/jpeg", "data": bytes(d)}); content.append("Valor da nota?")
     else: content.append(f"{msg.text}")
     try:
-        resp = model_ai.generate_content(content); t = resp.text
+        try: resp = await ai_call(model.generate_content, content)
+        finally:
+            if myfile: ai_discard(myfile)
+        t = resp.text
         start, end = t.find("{"), t.rfind("}")
         if start != -1 and end != -1:
             data = json.loads(t[start:end+1])
             if data:
-                if data.get('type') == 'agenda': 
-                    db["reminders"].append({"text": data['text'], "time": data['time'], "chat_id": update.effective_chat.id})
-                    save_db(db); await wait.edit_text(f"⏰ Agendado: {data['text']} para {data['time']}"); return
-                if data.get('type') == 'mercado': db["shopping_list"].append(data['item']); save_db(db); await wait.edit_text(f"🛒 {data['item']}"); return
-                if 'val' in data: 
-                    db["transactions"].append({"id":str(uuid.uuid4())[:8], "type":data['type'], "value":float(data['val']), "category":data.get('cat','Geral'), "description":data.get('desc','IA'), "date":now.strftime("%d/%m/%Y %H:%M")})
-                    save_db(db); await wait.edit_text(f"✅ R$ {data['val']:.2f} ({data.get('desc')})"); return
-                if data.get('msg'): await wait.edit_text(data['msg']); return
+                if msg.text: PARSE_STATS["llm"] += 1; memo_put(memo_key(msg.text, now), data)
+                if await apply_entry(update, data, wait.edit_text, now): return
         await wait.edit_text(t.replace("```json", "").replace("```", ""))
+    except asyncio.TimeoutError: await wait.edit_text("⌛ IA demorou demais, tente de novo.")
     except Exception as e: await wait.edit_text(f"Erro IA: {e}")
 
+# --- IMPORTAÇÃO DE EXTRATO (CSV / OFX) ---
+IMPORT_AI_BATCH = int(os.getenv("IMPORT_AI_BATCH", "40"))  # descrições por prompt quando as regras não bastam
+CSV_COLS = (("date", ("data", "date", "dt")), ("kind", ("tipo", "natureza", "d/c", "c/d", "dc", "débito/crédito", "debito/credito")), ("credit", ("crédito", "credito", "entrada")), ("debit", ("débito", "debito", "saída", "saida")),
+            ("value", ("valor", "amount", "value", "quantia")), ("desc", ("descri", "hist", "memo", "title", "títul", "titul", "estabelecimento", "lançamento", "lancamento", "detalhe")))
+OFX_TAG = re.compile(r"<(/?)(\w+)>([^<\r\n]*)")
+OFX_KIND = {"CREDIT": "ganho", "DEP": "ganho", "INT": "ganho", "DIV": "ganho", "DIRECTDEP": "ganho",
+            "DEBIT": "gasto", "FEE": "gasto", "SRVCHG": "gasto", "ATM": "gasto", "POS": "gasto", "CHECK": "gasto", "DIRECTDEBIT": "gasto"}
+
+def csv_kind(s):
+    """Coluna de natureza ("D", "C", "Débito", "Crédito", "Saída"...) -> gasto/ganho, ou None."""
+    s = s.strip().lower().rstrip(".")
+    if s in ("d", "db", "deb", "débito", "debito", "saída", "saida", "-"): return "gasto"
+    if s in ("c", "cr", "cred", "crédito", "credito", "entrada", "+"): return "ganho"
+    return None
+
+def sniff_encoding(path):
+    with open(path, "rb") as f: head = f.read(65536)
+    try: codecs.getincrementaldecoder("utf-8")().decode(head); return "utf-8-sig"
+    except UnicodeDecodeError: return "cp1252"  # bancos brasileiros ainda exportam em latin-1/cp1252
+
+def parse_day(s):
+    s = s.strip()
+    for fmt, n in (("%d/%m/%Y", 10), ("%Y-%m-%d", 10), ("%d-%m-%Y", 10), ("%d.%m.%Y", 10), ("%d/%m/%y", 8)):
+        try: return datetime.strptime(s[:n], fmt).date()
+        except ValueError: pass
+    return None
+
+def parse_money(s):
+    """ "R$ -1.234,56", "(50,00)", "1,234.56", "-50.00", "1.234" (milhar) -> float com sinal, ou None se ambíguo."""
+    s = s.replace("R$", "").replace(" ", "").replace("\xa0", "")
+    neg = s.startswith(("-", "(")) or s.endswith("-"); s = s.strip("+-()")
+    if "," in s and "." in s: s = s.replace(".", "").replace(",", ".") if s.rfind(",") > s.rfind(".") else s.replace(",", "")
+    elif "." in s:  # sem vírgula: ponto seguido de 3 dígitos é milhar ("1.234"), de 1-2 é decimal ("50.5")
+        groups = s.split(".")
+        if all(len(g) == 3 for g in groups[1:]): s = "".join(groups)
+        elif len(groups) != 2 or len(groups[1]) > 2: return None
+    else: s = s.replace(",", ".")
+    try: v = float(s)
+    except ValueError: return None
+    return -v if neg else v
+
+def ofx_amount(s):
+    """TRNAMT do OFX é sempre decimal (ponto ou vírgula), nunca tem milhar: "-1.500" vale 1,5."""
+    try: return float(s.strip().replace(",", "."))
+    except ValueError: return None
+
+def csv_header(row):
+    cols = {}
+    for i, cell in enumerate(row):
+        c = cell.strip().lower()
+        for key, names in CSV_COLS:
+            hit = c.startswith(names) if key == "date" else c in names if key == "kind" else any(n in c for n in names)
+            if key not in cols and hit: cols[key] = i; break
+    return cols if "date" in cols and cols.keys() & {"value", "credit", "debit"} else None
+
+def read_csv(f):
+    """Linhas (dia, valor com sinal, descrição, tipo) ou None se ilegível. Delimitador e cabeçalho são
+    descobertos nas primeiras linhas (alguns bancos põem um preâmbulo antes do cabeçalho). O tipo vem das
+    colunas crédito/débito ou de uma coluna D/C; com uma coluna de valor só, fica None (o sinal não basta:
+    em extrato de conta negativo é gasto, em fatura de cartão é estorno/pagamento)."""
+    head = [f.readline() for _ in range(30)]; f.seek(0)
+    for delim in (";", ",", "\t", "|"):
+        if any(csv_header(r) for r in csv.reader(head, delimiter=delim)): break
+    else: raise ValueError("cabeçalho não reconhecido (preciso de colunas de data e valor)")
+    cols = None; cell = lambda r, k: r[cols[k]] if k in cols and cols[k] < len(r) else ""
+    for row in csv.reader(f, delimiter=delim):
+        if cols is None: cols = csv_header(row); continue
+        if not any(c.strip() for c in row): continue
+        day = parse_day(cell(row, "date"))
+        if "value" in cols: amount = parse_money(cell(row, "value")); kind = csv_kind(cell(row, "kind")) if "kind" in cols else None
+        else:
+            cr, dr = abs(parse_money(cell(row, "credit")) or 0), abs(parse_money(cell(row, "debit")) or 0)
+            amount = cr - dr; kind = "ganho" if cr > dr else "gasto"
+        yield (day, amount, cell(row, "desc"), kind) if day and amount is not None else None
+
+def read_ofx(f):
+    """OFX/QFX (SGML ou XML, com ou sem quebras de linha): um item por bloco <STMTTRN>."""
+    cur = None
+    for line in f:
+        for close, tag, val in OFX_TAG.findall(line):
+            tag = tag.upper()
+            if tag != "STMTTRN":
+                if cur is not None and not close: cur[tag] = val.strip()
+            elif not close: cur = {}
+            elif cur is not None:
+                dt, amount = cur.get("DTPOSTED", ""), ofx_amount(cur.get("TRNAMT", ""))
+                try: day = date(int(dt[:4]), int(dt[4:6]), int(dt[6:8]))
+                except ValueError: day = None
+                if day and amount is not None:  # no OFX o sinal é do ponto de vista do titular: negativo sempre sai
+                    yield day, amount, cur.get("MEMO") or cur.get("NAME") or "", OFX_KIND.get(cur.get("TRNTYPE", "").upper(), "gasto" if amount < 0 else "ganho")
+                else: yield None
+                cur = None
+
+@timed("import")
+def read_statement(path, ext):
+    """Lê o arquivo em streaming (roda numa thread). Retorna (linhas, ignoradas)."""
+    rows = []; bad = 0
+    with open(path, encoding=sniff_encoding(path), errors="replace", newline="") as f:
+        for r in (read_ofx(f) if ext in (".ofx", ".qfx") else read_csv(f)):
+            if r and r[1]: rows.append(r)
+            else: bad += 1
+    return rows, bad
+
+class CategoryRules:
+    """Categoria aprendida do histórico: descrição idêntica já lançada (maioria) > votos das palavras
+    (cada palavra reparte 1 voto pelas categorias onde já apareceu) > CAT_HINTS/match_category."""
+    MIN_SHARE = 0.6
+
+    def __init__(self): self.votes = {}; self.memo = {}
+
+    def word_votes(self, w, kind):
+        if (w, kind) not in self.votes:
+            c = Counter(t.category for t in TXINDEX.words.get(w, ()) if t.kind == kind); n = sum(c.values())
+            self.votes[w, kind] = {cat: x / n for cat, x in c.items()}
+        return self.votes[w, kind]
+
+    def guess(self, desc, kind):
+        words = [w for w in WORD_RE.findall(desc.lower()) if not w.isdigit()]
+        key = (" ".join(words), kind)
+        if key in self.memo: return self.memo[key]
+        cat = None
+        if words:
+            norm = lambda t: " ".join(w for w in WORD_RE.findall((t.description or "").lower()) if not w.isdigit())
+            same = Counter(t.category for t in min((TXINDEX.words.get(w, ()) for w in words), key=len) if t.kind == kind and norm(t) == key[0])
+            if same: cat = same.most_common(1)[0][0]
+            else:
+                score = Counter()
+                for w in set(words):
+                    if len(w) > 2:
+                        for c, v in self.word_votes(w, kind).items(): score[c] += v
+                if score and score.most_common(1)[0][1] / sum(score.values()) >= self.MIN_SHARE: cat = score.most_common(1)[0][0]
+                else: cat = match_category(words, TX_TYPES[kind])
+        self.memo[key] = cat
+        return cat
+
+async def ai_categorize(pending):
+    """{(kind, descrição)} que as regras não resolveram -> {(kind, descrição): categoria}, IMPORT_AI_BATCH por prompt."""
+    model = await get_model(); out = {}
+    if not model or not pending: return out
+    async def batch(kind, chunk):
+        cats = db["categories"].get(TX_TYPES[kind], [])
+        prompt = ("SYSTEM: Classificador de extrato bancário. Responda só JSON.\n"
+                  f"Categorias de {TX_TYPES[kind]}: {', '.join(cats)}\n"
+                  'Para cada linha numerada escolha UMA categoria da lista. Formato: {"1": "Categoria", "2": "Categoria"}\n'
+                  + "\n".join(f"{i}. {d}" for i, d in enumerate(chunk, 1)))
+        try:
+            t = (await ai_call(model.generate_content, prompt)).text
+            data = json.loads(t[t.find("{"):t.rfind("}") + 1])
+        except Exception as e: logger.warning(f"Importação: lote da IA falhou ({e})"); return
+        if isinstance(data, dict):
+            for i, d in enumerate(chunk, 1):
+                if data.get(str(i)) in cats: out[kind, d] = data[str(i)]
+    by_kind = {}
+    for kind, d in sorted(pending): by_kind.setdefault(kind, []).append(d)
+    await asyncio.gather(*(batch(k, ds[i:i + IMPORT_AI_BATCH]) for k, ds in by_kind.items() for i in range(0, len(ds), IMPORT_AI_BATCH)))
+    return out
+
+async def import_rows(rows, card=False):
+    """Deduplica contra o histórico (multiconjunto de content_hash: só entra o que exceder o que já existe),
+    categoriza (regras, depois IA em lotes, por fim "Outros") e grava tudo num único add_many + commit.
+    Linhas sem tipo usam o sinal conforme o layout escolhido pelo usuário: conta (negativo = gasto) ou
+    cartão (positivo = gasto)."""
+    if not TXINDEX.ready: TXINDEX.build()
+    rules = CategoryRules(); seen = Counter(); new = []; pending = set(); st = Counter(read=len(rows))
+    for day, amount, desc, kind in rows:
+        kind = type_code(kind or ("gasto" if (amount > 0 if card else amount < 0) else "ganho")); value = round(abs(amount), 2); desc = " ".join(desc.split()) or "Importado"
+        h = content_hash(day.toordinal(), value, kind, desc); seen[h] += 1
+        if seen[h] <= TXINDEX.hashes.get(h, 0): st["dup"] += 1; continue
+        cat = rules.guess(desc, kind)
+        if cat: st["rule"] += 1
+        else: pending.add((kind, desc))
+        new.append((day, value, kind, desc, cat))
+    ai = await ai_categorize(pending); cats_changed = False; ts = []
+    for day, value, kind, desc, cat in new:
+        if not cat:
+            cat = ai.get((kind, desc))
+            if cat: st["ai"] += 1
+            else:
+                cat = "Outros"; st["other"] += 1; lst = db["categories"].setdefault(TX_TYPES[kind], [])
+                if cat not in lst: lst.append(cat); cats_changed = True
+        ts.append({"id": str(uuid.uuid4())[:8], "type": TX_TYPES[kind], "value": value, "category": cat, "description": desc, "date": f"{day:%d/%m/%Y} 00:00"})
+    added = add_transactions(ts); save_db(db, *(("categories",) if cats_changed else ())); st["new"] = len(added)
+    return added, st
+
+@restricted
+async def import_document(update, context):
+    """Documento .csv/.ofx/.qfx enviado no chat: importa o extrato inteiro de uma vez."""
+    doc = update.message.document; ext = os.path.splitext(doc.file_name or "")[1].lower(); t0 = time.perf_counter()
+    wait = await update.message.reply_text("⏳ Lendo extrato...")
+    fd, path = tempfile.mkstemp(prefix="extrato_", suffix=ext); os.close(fd)
+    try:
+        await (await doc.get_file()).download_to_drive(path)
+        rows, bad = await asyncio.to_thread(read_statement, path, ext)
+        if not rows: await wait.edit_text("⚠️ Nenhuma transação encontrada no arquivo."); return
+        if any(r[3] is None for r in rows):  # só uma coluna de valor: o sinal depende de ser conta ou cartão
+            context.user_data["imp_rows"] = (rows, bad)
+            kb = [[InlineKeyboardButton("🏦 Conta (negativo = gasto)", callback_data="imp_as_bank")], [InlineKeyboardButton("💳 Fatura de cartão (positivo = gasto)", callback_data="imp_as_card")]]
+            await wait.edit_text(f"📄 {len(rows)} linhas lidas. Esse arquivo é extrato de conta ou fatura de cartão?", reply_markup=InlineKeyboardMarkup(kb)); return
+        await wait.edit_text(f"⏳ {len(rows)} linhas lidas, categorizando...")
+        await import_finish(wait.edit_text, context, rows, bad, t0)
+    except Exception as e: logger.warning(f"Importação falhou: {e}"); await wait.edit_text(f"❌ Não consegui importar: {e}"); return
+    finally:
+        if os.path.exists(path): os.remove(path)
+
+async def import_finish(say, context, rows, bad, t0, card=False):
+    added, st = await import_rows(rows, card)
+    context.user_data["imp"] = [t.id for t in added]
+    txt = (f"📥 *Extrato importado* ({time.perf_counter() - t0:.1f}s)\nLinhas: {st['read']} | Novas: {st['new']} | Duplicadas: {st['dup']}"
+           + (f" | Ignoradas: {bad}" if bad else "") + f"\nCategorias: {st['rule']} pelo histórico, {st['ai']} pela IA, {st['other']} em Outros")
+    kb = [[InlineKeyboardButton("📝 Ver extrato", callback_data="rep_list"), InlineKeyboardButton("↩️ Desfazer", callback_data="imp_undo")]] if added else []
+    await say(txt, reply_markup=InlineKeyboardMarkup(kb) if kb else None, parse_mode="Markdown")
+
+async def import_as(update, context):
+    """Resposta à pergunta conta/cartão: importa as linhas guardadas com a regra de sinal escolhida."""
+    q = update.callback_query; pend = context.user_data.pop("imp_rows", None)
+    if not pend: await q.answer("Envie o arquivo de novo."); return
+    await q.answer(); await q.edit_message_text(f"⏳ {len(pend[0])} linhas lidas, categorizando...")
+    try: await import_finish(q.edit_message_text, context, *pend, time.perf_counter(), card=q.data == "imp_as_card")
+    except Exception as e: logger.warning(f"Importação falhou: {e}"); await q.edit_message_text(f"❌ Não consegui importar: {e}")
+
+async def import_undo(update, context):
+    ids = context.user_data.pop("imp", None)
+    if not ids: await update.callback_query.answer("Nada para desfazer."); return
+    n = remove_transactions(ids); save_db(db)
+    await update.callback_query.answer("Desfeito!"); await update.callback_query.edit_message_text(f"↩️ Importação desfeita: {n} transações removidas.")
+
 # ================= MAIN =================
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "8"))
+
+class ChatUpdateProcessor(BaseUpdateProcessor):
+    """Até CONCURRENT_UPDATES updates em paralelo, mas um por vez em cada chat: os ConversationHandler
+    supõem updates em sequência, então duas mensagens rápidas do mesmo chat não podem correr juntas."""
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates); self.locks = {}
+
+    async def do_process_update(self, update, coroutine):
+        chat = getattr(update, "effective_chat", None); user = getattr(update, "effective_user", None)
+        key = chat.id if chat else user.id if user else None
+        if key is None: await coroutine; return
+        entry = self.locks.setdefault(key, [asyncio.Lock(), 0]); entry[1] += 1  # [lock, updates esperando ou rodando]
+        try:
+            async with entry[0]: await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]: del self.locks[key]
+
+    async def initialize(self): pass
+
+    async def shutdown(self): pass
+# Webhook: com WEBHOOK_URL (URL pública que chega nesta porta) o Telegram entrega os updates por POST
+# no mesmo Flask da porta 10000, em vez do long polling. Fila limitada: cheia = 503 e o Telegram reenvia.
+HTTP_PORT = int(os.getenv("PORT", "10000"))
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+UPDATE_QUEUE_MAX = int(os.getenv("UPDATE_QUEUE_MAX", "256"))
+HOOK_STATS = {"ok": 0, "denied": 0, "full": 0, "bad": 0}
+
+async def enqueue_update(app, upd):
+    try: app.update_queue.put_nowait(upd)
+    except asyncio.QueueFull: return False
+    if len(UPDATE_ENQ) > 10000: UPDATE_ENQ.clear()  # updates que nenhum handler consumiu
+    UPDATE_ENQ[upd.update_id] = time.perf_counter(); return True
+
+def webhook_view(app):
+    """POST do Telegram (thread do Flask) -> update_queue da Application (loop do bot)."""
+    def hook():
+        if not hmac.compare_digest(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), WEBHOOK_SECRET):
+            HOOK_STATS["denied"] += 1; return "forbidden", 403
+        if LOOP is None: return "starting", 503, {"Retry-After": "1"}
+        try: upd = Update.de_json(request.get_json(force=True), app.bot)
+        except Exception: HOOK_STATS["bad"] += 1; return "bad update", 400
+        if not asyncio.run_coroutine_threadsafe(enqueue_update(app, upd), LOOP).result(timeout=5):
+            HOOK_STATS["full"] += 1; return "busy", 503, {"Retry-After": "1"}
+        HOOK_STATS["ok"] += 1; return "ok"
+    return hook
+
+def health_view(app):
+    def health():
+        q = app.update_queue
+        return jsonify(ok=LOOP is not None, mode="webhook" if WEBHOOK_URL else "polling", queue=q.qsize(), queue_max=q.maxsize, webhook=HOOK_STATS)
+    return health
+
+def metrics_view(app):
+    def metrics():
+        with METRIC_LOCK: hist = {k: (list(h[0]), h[1]) for k, h in METRICS.items()}; errs = dict(METRIC_ERRORS)
+        out = ["# HELP bot_op_seconds Latência por operação", "# TYPE bot_op_seconds histogram"]
+        for (kind, op), (counts, total) in sorted(hist.items()):
+            acc = 0
+            for le, c in zip(METRIC_BUCKETS + ("+Inf",), counts):
+                acc += c; out.append(f'bot_op_seconds_bucket{{kind="{kind}",op="{op}",le="{le}"}} {acc}')
+            out.append(f'bot_op_seconds_sum{{kind="{kind}",op="{op}"}} {total:.6f}'); out.append(f'bot_op_seconds_count{{kind="{kind}",op="{op}"}} {acc}')
+        out += metric_lines("bot_op_errors_total", "Exceções por operação", "counter", [({"kind": k, "op": o}, n) for (k, o), n in sorted(errs.items())])
+        if TENANT_MODE: files = [GLOBAL_BASE + e for e in (".json", ".journal", ".journal.1", ".sqlite3", ".sqlite3-wal")]
+        else: files = [DB_FILE, JOURNAL_FILE, JOURNAL_FILE + ".1", SQLITE_FILE, SQLITE_FILE + "-wal"]
+        out += metric_lines("bot_db_size_bytes", "Tamanho dos arquivos do banco", "gauge", [({"file": f}, os.path.getsize(f)) for f in files if os.path.exists(f)])
+        if TENANT_MODE:  # um gauge somado: um label por arquivo de usuário explodiria as séries
+            out += metric_lines("bot_tenant_db_size_bytes", "Soma dos arquivos das partições de usuário", "gauge", [({"dir": TENANT_DIR}, tenant_dir_size())])
+        out += metric_lines("bot_transactions", "Transações carregadas", "gauge", [({}, len(db["transactions"]))])
+        if TENANT_MODE: out += metric_lines("bot_tenants_loaded", "Partições de usuário na memória", "gauge", [({}, len(TENANTS.loaded))])
+        out += metric_lines("bot_update_queue", "Updates esperando handler", "gauge", [({}, app.update_queue.qsize())])
+        out += metric_lines("bot_writer_queue", "Registros esperando o writer", "gauge", [({}, WRITER.q.qsize())])
+        out += metric_lines("bot_writer_commits_total", "Commits do writer", "counter", [({}, WRITER.commits)])
+        out += metric_lines("bot_parser_total", "Entradas por caminho do parser", "counter", [({"path": k}, v) for k, v in PARSE_STATS.items()])
+        out += metric_lines("bot_webhook_total", "Requisições do webhook", "counter", [({"status": k}, v) for k, v in HOOK_STATS.items()])
+        return "\n".join(out) + "\n", 200, {"Content-Type": "text/plain; version=0.0.4"}
+    return metrics
+
+async def serve_webhook(app):
+    """Ciclo de vida da Application sem o Updater: quem recebe os updates é o Flask."""
+    stop = asyncio.Event(); loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM): loop.add_signal_handler(sig, stop.set)
+    async with app:
+        await post_init(app)
+        await app.start()
+        await app.bot.set_webhook(WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES, max_connections=CONCURRENT_UPDATES)
+        await stop.wait()
+        await app.stop()
+    await post_shutdown(app)
+
+def fake_telegram(n=20, chat_id=None, url=None):
+    """Simula o Telegram contra o webhook local (teste sem rede): n mensagens de texto, imprime os status."""
+    url = url or f"http://127.0.0.1:{HTTP_PORT}{WEBHOOK_PATH}"; chat_id = int(chat_id or ADMIN_ID or 1)
+    codes = {}
+    for i in range(int(n)):
+        upd = {"update_id": 900000 + i, "message": {"message_id": i + 1, "date": int(time.time()), "text": f"Gastei {i + 1} teste",
+               "chat": {"id": chat_id, "type": "private"}, "from": {"id": chat_id, "is_bot": False, "first_name": "Fake"}}}
+        req = urllib.request.Request(url, json.dumps(upd).encode(), {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET})
+        try: code = urllib.request.urlopen(req, timeout=10).status
+        except urllib.error.HTTPError as e: code = e.code
+        codes[code] = codes.get(code, 0) + 1
+    print(f"📨 {n} updates -> {codes}")
+    return codes
+
+async def post_init(app):
+    global LOOP
+    LOOP = asyncio.get_running_loop()
+    SCHED_TASKS.add(asyncio.create_task(scheduler_loop(app)))
+    if GEMINI_KEY: SCHED_TASKS.add(asyncio.create_task(get_model()))
+    STARTUP["ready"] = time.perf_counter() - _T0
+    print(f"⏱️ Pronto para o primeiro update em {STARTUP['ready']:.2f}s (import {STARTUP['import']:.2f}s)")
+
+async def post_shutdown(app): WRITER.close()
+
 def main():
     print("🚀 V119 FULL TEXT ONLINE...")
+    app_bot = (ApplicationBuilder().token(TOKEN).concurrent_updates(ChatUpdateProcessor(CONCURRENT_UPDATES)).update_queue(asyncio.Queue(UPDATE_QUEUE_MAX))
+               .post_init(post_init).post_shutdown(post_shutdown).build())
     app_flask = Flask('')
     @app_flask.route('/')
     def home(): return "V119 OK"
-    threading.Thread(target=lambda: app_flask.run(host='0.0.0.0', port=10000), daemon=True).start()
+    app_flask.add_url_rule('/health', 'health', health_view(app_bot))
+    app_flask.add_url_rule('/metrics', 'metrics', metrics_view(app_bot))
+    if WEBHOOK_URL: app_flask.add_url_rule(WEBHOOK_PATH, 'telegram', webhook_view(app_bot), methods=['POST'])
+    threading.Thread(target=lambda: app_flask.run(host='0.0.0.0', port=HTTP_PORT, threaded=True), daemon=True).start()
     
-    app_bot = ApplicationBuilder().token(TOKEN).build()
     app_bot.add_handler(CommandHandler("start", start))
     app_bot.add_handler(CommandHandler("cancel", cancel_op))
     app_bot.add_handler(CommandHandler("sub", sub_cmd))
+    app_bot.add_handler(CommandHandler("exportar", export_cmd))
+    app_bot.add_handler(CommandHandler("extrato", statement_cmd))
     
     app_bot.add_handler(ConversationHandler(
         entry_points=[MessageHandler(filters.Regex(r"^(💸 Gasto|💰 Ganho)$"), manual_gasto_trigger)],
@@ -550,25 +2555,30 @@ def main():
 
     cbs = [("menu_shop", menu_shop), ("menu_debts", menu_debts), ("sl_c", sl_c), ("back", start),
            ("menu_reports", menu_reports), ("rep_list", rep_list), ("rep_pie", rep_pie), ("rep_pdf", rep_pdf), ("rep_nospend", rep_nospend), ("rep_insights", rep_insights), ("rep_csv", rep_csv), ("rep_evo", rep_evo),
-           ("menu_manage_trans", menu_manage_trans), ("del_tr_", delete_transaction_confirm),
+           ("menu_manage_trans", menu_manage_trans), ("del_tr_", delete_transaction_confirm), ("ext_", statement_nav), ("txv_", tx_view), ("imp_undo", import_undo), ("imp_as_", import_as),
            ("menu_agenda", menu_agenda), ("del_agenda_all", agenda_del),
            ("menu_cats", menu_cats), ("c_del", c_del), ("kc_", c_kill),
            ("menu_conf", menu_conf), ("tg_panic", tg_panic), ("menu_persona", menu_persona), ("sp_", set_persona), ("menu_subs", menu_subs), ("sub_add", sub_add_help), ("sub_del", sub_del_menu),
            ("roleta", roleta), ("menu_help", menu_help), ("backup", backup), ("admin_panel", admin_panel), ("undo_quick", undo_quick),
            ("ed_", edit_debt_menu), ("da_", debt_action), ("sc_", reg_cat),
            ("menu_iptv", menu_iptv), ("iptv_list", iptv_list), ("iptv_manage_", iptv_manage_client), 
-           ("iptv_msg_", iptv_gen_msg), ("iptv_late_", iptv_late_msg), ("iptv_pay_", iptv_pay_confirm), ("iptv_kill_", iptv_kill), ("iptv_edit_menu_", iptv_edit_menu),
+           ("iptv_msg_", iptv_gen_msg), ("iptv_late_", iptv_late_msg), ("iptv_pay_", iptv_pay_confirm), ("iptv_kill_", iptv_kill), ("iptv_edit_menu_", iptv_edit_menu), ("iptv_bulk", iptv_bulk), ("iptv_go_bulk", iptv_go_bulk),
            ("menu_goals", menu_goals), ("goal_del", goal_del), ("menu_badges", menu_badges), ("rep_rank", rep_rank), ("rep_comp", rep_comp), ("rep_forecast", rep_forecast)]
     
     for p, f in cbs: app_bot.add_handler(CallbackQueryHandler(f, pattern=f"^{p}"))
-    app_bot.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, restricted(smart_entry)))
+    app_bot.add_handler(MessageHandler(filters.Document.FileExtension("csv") | filters.Document.FileExtension("ofx") | filters.Document.FileExtension("qfx"), import_document, block=False))
+    app_bot.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, restricted(smart_entry), block=False))  # IA não segura a fila
+    if TENANT_MODE: wrap_handlers(app_bot, tenant_handler, "_tenant")
+    instrument_handlers(app_bot)
     
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(routine_checks, 'interval', minutes=1, args=[app_bot])
-    scheduler.start()
-    
-    print("✅ V119 FULL TEXT ONLINE!")
-    app_bot.run_polling()
+    print(f"✅ V119 FULL TEXT ONLINE! ({'webhook ' + WEBHOOK_URL if WEBHOOK_URL else 'polling'})")
+    if WEBHOOK_URL: asyncio.run(serve_webhook(app_bot))
+    else: app_bot.run_polling()
+
+STARTUP = {"import": time.perf_counter() - _T0, "ready": None}
 
 if __name__ == "__main__":
-    main()
+    if "--migrate-sqlite" in sys.argv: migrate_to_sqlite()
+    elif "--restore" in sys.argv: restore_backup(*sys.argv[sys.argv.index("--restore") + 1:][:1])
+    elif "--fake-telegram" in sys.argv: fake_telegram(*sys.argv[sys.argv.index("--fake-telegram") + 1:][:2])
+    else: main()